@@ -3,171 +3,2816 @@ import numpy as np
 from fuzzywuzzy import fuzz
 from fuzzywuzzy import process
 import re
-from typing import Dict, List, Tuple, Any
+import os
+import pickle
+import sqlite3
+import hashlib
+import json
+import sys
+import time
+import math
+import logging
+import tracemalloc
+from statistics import NormalDist
+from array import array
+import argparse
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Tuple, Any, Optional, Iterable, Iterator, Union
 import openpyxl
 import datetime # <-- Added for timestamp
 
+logger = logging.getLogger(__name__)
+
+class Diagnostics:
+    """
+    De-duplicating warning log.
+    
+    Each distinct warning goes to the logger the first time it occurs and is
+    only counted after that, so warnings raised inside the matching loops do
+    not flood the output. flush() reports the repeat counts.
+    """
+    
+    def __init__(self, log: Optional[logging.Logger] = None):
+        """
+        Initialize an empty diagnostics log.
+        
+        Args:
+            log: Logger to write to (default: this module's logger)
+        """
+        self.log = log or logger
+        self.counts = {}
+        self.messages = {}
+        self._reported = {}
+    
+    def warning(self, key: Any, message: str, *args):
+        """
+        Count a warning and log it if it is the first of its kind.
+        
+        Args:
+            key: Hashable identity of the warning, e.g. ('missing_column', col)
+            message: Logging format string, only formatted on first occurrence
+            *args: Arguments for the format string
+        """
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count == 1:
+            self.messages[key] = message % args if args else message
+            self._reported[key] = 1
+            self.log.warning(self.messages[key])
+    
+    def flush(self):
+        """Log the occurrence count of every warning that repeated since it was last reported."""
+        for key, count in self.counts.items():
+            if count > self._reported[key]:
+                self.log.warning("%s (%s occurrences)", self.messages[key], f"{count:,}")
+                self._reported[key] = count
+    
+    def to_list(self) -> List[Dict[str, Any]]:
+        """
+        Collect the warnings as JSON-serializable records.
+        
+        Returns:
+            List of {'message', 'count'} dicts, most frequent first
+        """
+        records = [{'message': self.messages[key], 'count': count} for key, count in self.counts.items()]
+        return sorted(records, key=lambda record: -record['count'])
+
+
+class MatchMetrics:
+    """
+    Counters and phase timings for a matching run, with a live progress line.
+    
+    With profile_memory set, each phase also records its tracemalloc peak and
+    the source lines that allocated the most memory during it. Tracing is
+    only on inside phases: a phase that starts tracemalloc stops it again.
+    """
+    
+    def __init__(self, progress_interval: float = 0.5, profile_memory: bool = False,
+                 top_sites: int = 5):
+        """
+        Initialize empty metrics.
+        
+        Args:
+            progress_interval: Minimum seconds between progress line updates
+            profile_memory: Trace allocations per phase with tracemalloc. This
+                slows the run down noticeably and is meant for capacity planning.
+            top_sites: Number of allocation sites to keep per phase
+        """
+        self.progress_interval = progress_interval
+        self.profile_memory = profile_memory
+        self.top_sites = top_sites
+        self.phase_seconds = {}
+        self.phase_memory = {}
+        self.diagnostics = Diagnostics()
+        self.start_run(0)
+    
+    def start_run(self, total_rows: int, threshold: Optional[int] = None):
+        """
+        Reset the counters for a new matching run. Phase timings are kept so
+        that the load phase from __init__ stays part of the run.
+        
+        Args:
+            total_rows: Number of df1 rows to process
+            threshold: Minimum similarity score used for the run
+        """
+        self.total_rows = total_rows
+        self.threshold = threshold
+        self.rows_processed = 0
+        self.rows_resumed = 0
+        self.matched_rows = 0
+        self.comparisons = 0
+        self.comparisons_pruned = 0
+        self.run_started = time.perf_counter()
+        self.run_seconds = 0.0
+        self._last_progress = 0.0
+        for name in ('materialize', 'match', 'secondary', 'dataframe', 'report'):
+            self.phase_seconds.pop(name, None)
+            self.phase_memory.pop(name, None)
+    
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager that adds the time spent inside it to a phase.
+        
+        Args:
+            name: Phase name (load, materialize, match, secondary, dataframe, report)
+        """
+        started_tracing = False
+        before = None
+        if self.profile_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            # Allocation sites come from the first run of a phase only; later
+            # checkpoint ranges just update its peak
+            if name not in self.phase_memory:
+                before = tracemalloc.take_snapshot()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.perf_counter() - started
+            if self.profile_memory:
+                self._record_phase_memory(name, before, start_bytes)
+                if started_tracing:
+                    tracemalloc.stop()
+    
+    def _record_phase_memory(self, name: str, before: Optional[tracemalloc.Snapshot], start_bytes: int):
+        """
+        Record the allocation peak and top allocation sites of one phase run.
+        Phases that run once per checkpoint range keep their highest peak.
+        
+        Args:
+            name: Phase name
+            before: Snapshot taken when the phase started, or None when the
+                phase already has its allocation sites
+            start_bytes: Traced memory when the phase started
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        previous = self.phase_memory.get(name)
+        if previous is not None:
+            if peak - start_bytes > previous['peak_increase_bytes']:
+                previous.update(start_bytes=start_bytes, peak_bytes=peak,
+                                peak_increase_bytes=peak - start_bytes,
+                                retained_bytes=current - start_bytes)
+            return
+        
+        after = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        sites = []
+        for stat in after.compare_to(before, 'lineno'):
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            filename = os.path.join(*os.path.normpath(frame.filename).split(os.sep)[-2:])
+            sites.append({'site': f"{filename}:{frame.lineno}",
+                          'bytes': stat.size_diff, 'blocks': stat.count_diff})
+            if len(sites) >= self.top_sites:
+                break
+        
+        self.phase_memory[name] = {
+            'start_bytes': start_bytes,
+            'peak_bytes': peak,
+            'peak_increase_bytes': peak - start_bytes,
+            'retained_bytes': current - start_bytes,
+            'top_sites': sites,
+        }
+    
+    def memory_summary(self) -> str:
+        """
+        Format the per-phase memory profile as a compact text report.
+        
+        Returns:
+            One line per phase with its peaks, followed by its top allocation sites
+        """
+        if not self.phase_memory:
+            return "No memory profile recorded (profile_memory is off)"
+        mib = lambda n: f"{n / 2**20:,.1f} MiB"
+        lines = [f"{'phase':12} {'peak':>12} {'+peak':>12} {'retained':>12}"]
+        for name, memory in self.phase_memory.items():
+            lines.append(f"{name:12} {mib(memory['peak_bytes']):>12} "
+                         f"{mib(memory['peak_increase_bytes']):>12} {mib(memory['retained_bytes']):>12}")
+            for site in memory['top_sites']:
+                lines.append(f"    {site['site']:48} {mib(site['bytes']):>12} in {site['blocks']:,} blocks")
+        return '\n'.join(lines)
+    
+    def row_done(self, matched: bool, show_progress: bool = True):
+        """
+        Count one processed df1 row and refresh the progress line if due.
+        
+        Args:
+            matched: Whether the row found a df2 match
+            show_progress: Whether to write the progress line
+        """
+        self.rows_processed += 1
+        if matched:
+            self.matched_rows += 1
+        if show_progress:
+            now = time.perf_counter()
+            if now - self._last_progress >= self.progress_interval:
+                self._last_progress = now
+                sys.stderr.write('\r' + self.progress_line())
+                sys.stderr.flush()
+    
+    def finish(self, show_progress: bool = True):
+        """
+        Record the run duration and end the progress line.
+        
+        Args:
+            show_progress: Whether the progress line was shown
+        """
+        self.run_seconds = time.perf_counter() - self.run_started
+        if show_progress:
+            sys.stderr.write('\r' + self.progress_line() + '\n')
+            sys.stderr.flush()
+    
+    @property
+    def rows_per_second(self) -> float:
+        """Rows processed per second in this run (resumed rows excluded)."""
+        elapsed = self.run_seconds or (time.perf_counter() - self.run_started)
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+    
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Estimated seconds until all rows are processed, or None if unknown."""
+        remaining = self.total_rows - self.rows_resumed - self.rows_processed
+        rate = self.rows_per_second
+        if remaining <= 0:
+            return 0.0
+        return remaining / rate if rate > 0 else None
+    
+    def progress_line(self) -> str:
+        """
+        Format the live progress line.
+        
+        Returns:
+            Single line describing progress, throughput and ETA
+        """
+        done = self.rows_resumed + self.rows_processed
+        percent = done / self.total_rows * 100 if self.total_rows else 100.0
+        eta = self.eta_seconds
+        eta_text = str(datetime.timedelta(seconds=int(eta))) if eta is not None else '--:--:--'
+        return (f"{done:,}/{self.total_rows:,} rows ({percent:.1f}%) | "
+                f"{self.rows_per_second:,.1f} rows/s | ETA {eta_text} | "
+                f"{self.comparisons:,} compared, {self.comparisons_pruned:,} pruned | "
+                f"{self.matched_rows:,} matched")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Collect the metrics as a JSON-serializable dict.
+        
+        Returns:
+            Dict of counters, throughput and phase timings
+        """
+        return {
+            'threshold': self.threshold,
+            'total_rows': self.total_rows,
+            'rows_processed': self.rows_processed,
+            'rows_resumed': self.rows_resumed,
+            'matched_rows': self.matched_rows,
+            'comparisons': self.comparisons,
+            'comparisons_pruned': self.comparisons_pruned,
+            'run_seconds': round(self.run_seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 3),
+            'phase_seconds': {name: round(seconds, 3) for name, seconds in self.phase_seconds.items()},
+            'phase_memory': self.phase_memory,
+            'warnings': self.diagnostics.to_list(),
+        }
+    
+    def summary_columns(self) -> Dict[str, Any]:
+        """
+        Key numbers for the Summary sheet of the match report.
+        
+        Returns:
+            Dict of column name to value
+        """
+        columns = {
+            'Rows Processed': self.rows_processed,
+            'Rows Resumed from Checkpoint': self.rows_resumed,
+            'Comparisons Made': self.comparisons,
+            'Comparisons Pruned': self.comparisons_pruned,
+            'Rows per Second': round(self.rows_per_second, 2),
+            'Run Time (s)': round(self.run_seconds, 2),
+        }
+        for name, seconds in self.phase_seconds.items():
+            columns[f'{name.capitalize()} Time (s)'] = round(seconds, 2)
+        for name, memory in self.phase_memory.items():
+            columns[f'{name.capitalize()} Peak Memory (MiB)'] = round(memory['peak_bytes'] / 2**20, 1)
+        return columns
+    
+    def write_json(self, path: str):
+        """
+        Write the metrics to a JSON file.
+        
+        Args:
+            path: Output file path
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class ResultAccumulator:
+    """
+    Columnar store for match results.
+    
+    Columns are declared up front from the mapping plan and filled as typed
+    arrays (int64 row indices, int16 scores, bool match flags and
+    dictionary-encoded string values) instead of building one dict per row.
+    """
+    
+    INDEX = 'index'
+    SCORE = 'score'
+    FLAG = 'flag'
+    TEXT = 'text'
+    
+    def __init__(self, plan: List[Tuple[str, str, List[str], List[str]]], include_values: bool = True):
+        """
+        Declare the result columns for a mapping plan.
+        
+        Args:
+            plan: Mapping plan from ExcelFuzzyMapper._compile_mapping_plan
+            include_values: Keep the value1_*/value2_* columns; without them
+                only the row indices, scores and match flags are stored
+        """
+        self.plan = plan
+        self.include_values = include_values
+        self.kinds = {
+            'df1_row_index': self.INDEX,
+            'df2_row_index': self.INDEX,
+            'primary_key_score': self.SCORE,
+            'primary_key_value': self.TEXT,
+        }
+        mapping_columns = []
+        for source_expr, target_expr, _, _ in plan:
+            names = (f'mapping_{source_expr}_to_{target_expr}_score',
+                     f'mapping_{source_expr}_to_{target_expr}_match',
+                     f'value1_{source_expr}' if include_values else None,
+                     f'value2_{target_expr}' if include_values else None)
+            for name, kind in zip(names, (self.SCORE, self.FLAG, self.TEXT, self.TEXT)):
+                if name is not None:
+                    self.kinds.setdefault(name, kind)
+            mapping_columns.append(names)
+        
+        # When two mappings produce the same column name only the last one
+        # keeps its value, as it did with the per-row result dicts
+        last_writer = {}
+        for pos, names in enumerate(mapping_columns):
+            for name in names:
+                last_writer[name] = pos
+        self._writers = [tuple(name if name is not None and last_writer[name] == pos else None
+                               for name in names)
+                         for pos, names in enumerate(mapping_columns)]
+        
+        self._data = {}
+        self._categories = {}
+        self._codes = {}
+        for name, kind in self.kinds.items():
+            if kind == self.INDEX:
+                self._data[name] = array('q')
+            elif kind == self.SCORE:
+                self._data[name] = array('h')
+            elif kind == self.FLAG:
+                self._data[name] = array('b')
+            else:
+                self._data[name] = array('i')
+                self._categories[name] = []
+                self._codes[name] = {}
+        self.n_rows = 0
+    
+    def __len__(self) -> int:
+        return self.n_rows
+    
+    def _append(self, name: str, value):
+        """
+        Append one value to a column.
+        
+        Args:
+            name: Column name
+            value: Value to append
+        """
+        column = self._data[name]
+        if name in self._codes:
+            codes = self._codes[name]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self._categories[name])
+                self._categories[name].append(value)
+            column.append(code)
+            return
+        try:
+            column.append(value)
+        except (TypeError, OverflowError):
+            # Non-integer index labels fall back to a plain list
+            self._data[name] = list(column) + [value]
+    
+    def add(self, idx1, idx2, pk_score: int, pk_value1: str, outputs: List[Tuple[int, bool, str, str]]):
+        """
+        Add one matched row pair.
+        
+        Args:
+            idx1: Index label of the df1 row
+            idx2: Index label of the matched df2 row
+            pk_score: Primary key similarity score
+            pk_value1: Primary key value from df1
+            outputs: (score, is_match, value1, value2) for each mapping in the plan
+        """
+        self._append('df1_row_index', idx1)
+        self._append('df2_row_index', idx2)
+        self._append('primary_key_score', pk_score)
+        self._append('primary_key_value', pk_value1)
+        for names, values in zip(self._writers, outputs):
+            for name, value in zip(names, values):
+                if name is not None:
+                    self._append(name, value)
+        self.n_rows += 1
+    
+    def extend(self, other: 'ResultAccumulator'):
+        """
+        Append all rows of another accumulator built from the same plan.
+        
+        Args:
+            other: Accumulator to append
+        """
+        for name in self.kinds:
+            if name in self._codes:
+                categories = other._categories[name]
+                for code in other._data[name]:
+                    self._append(name, categories[code])
+            elif isinstance(self._data[name], array) and isinstance(other._data[name], array):
+                self._data[name].extend(other._data[name])
+            else:
+                self._data[name] = list(self._data[name]) + list(other._data[name])
+        self.n_rows += other.n_rows
+    
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Build the results DataFrame.
+        
+        Returns:
+            DataFrame with one column per declared result column
+        """
+        data = {}
+        for name, kind in self.kinds.items():
+            column = self._data[name]
+            if kind == self.TEXT:
+                data[name] = pd.Categorical.from_codes(np.array(column, dtype=np.int32),
+                                                       categories=self._categories[name])
+            elif kind == self.FLAG:
+                data[name] = np.array(column, dtype=bool)
+            elif kind == self.SCORE:
+                data[name] = np.array(column, dtype=np.int16)
+            elif isinstance(column, array):
+                data[name] = np.array(column, dtype=np.int64)
+            else:
+                data[name] = column
+        return pd.DataFrame(data)
+
+
+CSV_EXTENSIONS = ('.csv', '.tsv')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+# CSV cells are kept verbatim as text (so '00123' stays '00123'); only empty
+# cells are missing, like empty cells in Excel
+CSV_READ_OPTIONS = {'dtype': str, 'keep_default_na': False, 'na_values': ['']}
+
+# Version of the value handling above; reference stores built by another
+# version are rebuilt, since their keys may have been parsed differently
+TABLE_READER_VERSION = 2
+
+
+def _csv_columns(path: str, columns: Optional[set]) -> Tuple[str, List[str], Optional[List[str]]]:
+    """
+    Work out the separator, header and projected columns of a CSV/TSV file.
+    
+    Args:
+        path: Path to the file
+        columns: Optional column names to keep
+        
+    Returns:
+        Tuple of (separator, header column names, columns to read or None for all)
+    """
+    sep = '\t' if os.path.splitext(path)[1].lower() == '.tsv' else ','
+    header = [str(col) for col in pd.read_csv(path, sep=sep, nrows=0, **CSV_READ_OPTIONS).columns]
+    usecols = [col for col in header if col in columns] if columns is not None else None
+    return sep, header, usecols
+
+
+def _arrow_to_pandas(table: Any) -> pd.DataFrame:
+    """
+    Convert an Arrow table or record batch to pandas without changing values.
+    
+    Integer columns with nulls stay integers instead of becoming floats.
+    """
+    return table.to_pandas(integer_object_nulls=True)
+
+
+def read_table(path: str, columns: Optional[set] = None, sheet_name: Union[str, int] = 0) -> pd.DataFrame:
+    """
+    Read an input file, choosing the reader by file extension.
+    
+    CSV files use the multi-threaded pyarrow reader when pyarrow is installed,
+    and every cell is read as text either way, so results do not depend on
+    pyarrow. Parquet files are read with column projection and keep the
+    values as stored. Anything else is read with pd.read_excel as before.
+    
+    Args:
+        path: Path to a .csv/.tsv, .parquet/.pq or Excel file
+        columns: Optional column names to keep. Only CSV and Parquet inputs are
+            projected; names missing from the file are ignored.
+        sheet_name: Sheet to read from Excel files (name or position)
+        
+    Returns:
+        The loaded DataFrame
+    """
+    extension = os.path.splitext(path)[1].lower()
+    
+    if extension in CSV_EXTENSIONS:
+        sep, header, usecols = _csv_columns(path, columns)
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            return pd.read_csv(path, sep=sep, usecols=usecols, **CSV_READ_OPTIONS)
+        # pandas' pyarrow engine infers types before applying dtype, so the
+        # column types are given to the Arrow reader directly
+        convert_options = pa_csv.ConvertOptions(column_types={col: pa.string() for col in header},
+                                                null_values=[''], strings_can_be_null=True,
+                                                include_columns=usecols)
+        table = pa_csv.read_csv(path, parse_options=pa_csv.ParseOptions(delimiter=sep),
+                                convert_options=convert_options)
+        return _arrow_to_pandas(table)
+    
+    if extension in PARQUET_EXTENSIONS:
+        import pyarrow.parquet as pq
+        if columns is not None:
+            columns = [col for col in pq.read_schema(path).names if col in columns]
+        return _arrow_to_pandas(pq.read_table(path, columns=columns))
+    
+    return pd.read_excel(path, sheet_name=sheet_name)
+
+
+def list_sheets(path: str) -> List[str]:
+    """
+    List the sheet names of an Excel workbook.
+    
+    Args:
+        path: Path to the workbook
+        
+    Returns:
+        Sheet names in workbook order
+    """
+    with pd.ExcelFile(path) as workbook:
+        return [str(name) for name in workbook.sheet_names]
+
+
+def _read_frame_for_transfer(path: str, columns: Optional[set] = None,
+                             sheet_name: Union[str, int] = 0) -> Tuple[str, Any]:
+    """
+    Read an input file in a worker process and serialize it for the parent.
+    
+    The frame is sent back as an Arrow IPC stream when pyarrow is installed
+    and the columns convert cleanly, and as a pickled DataFrame otherwise.
+    
+    Args:
+        path: Path to the file
+        columns: Optional column names to keep (see read_table)
+        sheet_name: Sheet to read from Excel files
+        
+    Returns:
+        Tuple of (transfer format, payload)
+    """
+    df = read_table(path, columns, sheet_name)
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return 'arrow', sink.getvalue().to_pybytes()
+    except Exception:
+        # pyarrow missing, or mixed-type object columns Arrow cannot represent
+        return 'pickle', df
+
+
+def _frame_from_transfer(kind: str, payload: Any) -> pd.DataFrame:
+    """
+    Rebuild a DataFrame sent by _read_frame_for_transfer.
+    
+    Args:
+        kind: Transfer format ('arrow' or 'pickle')
+        payload: Serialized frame
+        
+    Returns:
+        The DataFrame
+    """
+    if kind == 'arrow':
+        import pyarrow as pa
+        return _arrow_to_pandas(pa.ipc.open_stream(pa.py_buffer(payload)).read_all())
+    return payload
+
+
+def load_frames_parallel(paths: List[str], columns: Optional[List[Optional[set]]] = None,
+                         sheet_name: Union[str, int] = 0) -> List[pd.DataFrame]:
+    """
+    Load several input files at the same time, one worker process per file.
+    
+    Args:
+        paths: Paths to the files
+        columns: Optional column names to keep, one entry per path (see read_table)
+        sheet_name: Sheet to read from Excel files
+        
+    Returns:
+        DataFrames in the order of paths
+    """
+    columns = columns or [None] * len(paths)
+    with ProcessPoolExecutor(max_workers=len(paths)) as executor:
+        return [_frame_from_transfer(kind, payload)
+                for kind, payload in executor.map(_read_frame_for_transfer, paths, columns,
+                                                  [sheet_name] * len(paths))]
+
+
+def iter_table_chunks(path: str, columns: Optional[set] = None, chunksize: int = 50000,
+                      sheet_name: Union[str, int] = 0) -> Iterator[pd.DataFrame]:
+    """
+    Read an input file in chunks of rows.
+    
+    CSV and Parquet files are streamed with the same value handling as
+    read_table; Excel files cannot be read incrementally by pandas and come
+    back as a single chunk. Index labels continue across chunks as if the
+    whole file had been read at once.
+    
+    Args:
+        path: Path to the file (see read_table)
+        columns: Optional column names to keep
+        chunksize: Rows per chunk for CSV and Parquet files
+        sheet_name: Sheet to read from Excel files
+        
+    Returns:
+        Iterator of DataFrames
+    """
+    extension = os.path.splitext(path)[1].lower()
+    
+    if extension in CSV_EXTENSIONS:
+        sep, _, usecols = _csv_columns(path, columns)
+        yield from pd.read_csv(path, sep=sep, usecols=usecols, chunksize=chunksize, **CSV_READ_OPTIONS)
+        return
+    
+    if extension in PARQUET_EXTENSIONS:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [col for col in parquet_file.schema_arrow.names if col in columns]
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            chunk = _arrow_to_pandas(batch)
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+        return
+    
+    yield read_table(path, columns, sheet_name)
+
+
+class ReferenceStore:
+    """
+    On-disk (SQLite) store for the materialized df2 keys and mapping values.
+    
+    Each df2 row keeps its lowercased primary key, the key length and the
+    concatenated value of every mapping target expression. The key length is
+    indexed, so the candidates whose length allows a score above the
+    threshold are fetched with an indexed range query, and matched rows are
+    fetched by row id. Memory use follows the candidates, not the reference.
+    """
+    
+    def __init__(self, db_path: str):
+        """
+        Open (or create) a store.
+        
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.value_exprs = []
+        self.row_count = 0
+        meta = self.meta()
+        if meta is not None:
+            self.value_exprs = meta['value_exprs']
+            self.row_count = meta['row_count']
+    
+    def __len__(self) -> int:
+        return self.row_count
+    
+    def meta(self) -> Optional[Dict[str, Any]]:
+        """
+        Read the description of what the store was built from.
+        
+        Returns:
+            Meta dict, or None for an empty store
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'build'").fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def build(self, source: Dict[str, Any], value_exprs: List[str],
+              rows: Iterable[Tuple[int, str, List[str]]]):
+        """
+        Replace the store contents.
+        
+        Args:
+            source: JSON-serializable description of the source file and mapping
+            value_exprs: Mapping target expressions stored per row
+            rows: (row id, lowercased key, values in value_exprs order) per df2 row
+        """
+        value_columns = [f'v{i}' for i in range(len(value_exprs))]
+        conn = self.conn
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('DROP TABLE IF EXISTS reference')
+        conn.execute('CREATE TABLE reference (row_id INTEGER PRIMARY KEY, pk TEXT, pk_len INTEGER'
+                     + ''.join(f', {col} TEXT' for col in value_columns) + ')')
+        insert = (f"INSERT INTO reference VALUES (?, ?, ?{', ?' * len(value_columns)})")
+        
+        row_count = 0
+        batch = []
+        for row_id, key, values in rows:
+            batch.append((row_id, key, len(key), *values))
+            if len(batch) >= 10000:
+                conn.executemany(insert, batch)
+                row_count += len(batch)
+                batch = []
+        conn.executemany(insert, batch)
+        row_count += len(batch)
+        
+        # The key length index is the blocking index for candidate queries
+        conn.execute('CREATE INDEX reference_pk_len ON reference (pk_len)')
+        meta = dict(source, value_exprs=value_exprs, row_count=row_count)
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('build', ?)", (json.dumps(meta),))
+        conn.commit()
+        self.value_exprs = value_exprs
+        self.row_count = row_count
+    
+    def candidates(self, len1: int, threshold: int) -> Iterator[Tuple[int, str, int]]:
+        """
+        Stream the rows whose key length allows a score of at least threshold.
+        
+        fuzz.ratio is at most 200 * min(len1, len2) / (len1 + len2), which
+        bounds the key lengths worth scoring.
+        
+        Args:
+            len1: Length of the df1 key
+            threshold: Minimum similarity score (0-100)
+            
+        Returns:
+            Iterator of (row id, lowercased key, key length) in row order
+        """
+        if threshold <= 0.5:
+            low, high = 0, None
+        else:
+            low = math.floor(len1 * (threshold - 0.5) / (200.5 - threshold))
+            high = math.ceil(len1 * (200.5 - threshold) / (threshold - 0.5))
+        
+        if high is None:
+            cursor = self.conn.execute('SELECT row_id, pk, pk_len FROM reference ORDER BY row_id')
+        else:
+            cursor = self.conn.execute('SELECT row_id, pk, pk_len FROM reference '
+                                       'WHERE pk_len BETWEEN ? AND ? ORDER BY row_id', (low, high))
+        yield from cursor
+    
+    def fetch(self, row_id: int) -> Dict[str, str]:
+        """
+        Fetch the stored mapping values of one row.
+        
+        Args:
+            row_id: Row id (df2 index label)
+            
+        Returns:
+            Dict of target expression to concatenated value
+        """
+        columns = ', '.join(f'v{i}' for i in range(len(self.value_exprs))) or 'row_id'
+        row = self.conn.execute(f'SELECT {columns} FROM reference WHERE row_id = ?', (row_id,)).fetchone()
+        return dict(zip(self.value_exprs, row))
+    
+    def head(self, n: int = 5) -> pd.DataFrame:
+        """
+        Show the first stored rows.
+        
+        Args:
+            n: Number of rows
+            
+        Returns:
+            DataFrame of the first n rows
+        """
+        return pd.read_sql_query(f'SELECT * FROM reference ORDER BY row_id LIMIT {int(n)}', self.conn)
+
+
+class ScoreStore:
+    """
+    Directory of memory-mappable arrays holding the scored candidate pairs of
+    a run: df1/df2 row labels, the primary key score and every mapping score
+    of each pair at or above the score floor.
+    
+    Scores are stored as uint8, so the arrays stay small without a
+    decompression step, and np.load(mmap_mode='r') reads them lazily.
+    Completed df1 ranges are written as part files and consolidated when the
+    run finishes, which keeps memory bounded and works with checkpointing.
+    """
+    
+    ARRAYS = ('df1_row', 'df2_row', 'pk_score', 'mapping_scores')
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Directory of the store
+        """
+        self.path = path
+        self.parts_dir = os.path.join(path, 'parts')
+    
+    def reset_parts(self, from_pos: int = 0):
+        """
+        Remove part files for df1 ranges starting at or after a position.
+        
+        Args:
+            from_pos: First df1 position whose parts are discarded
+        """
+        os.makedirs(self.parts_dir, exist_ok=True)
+        for name in os.listdir(self.parts_dir):
+            if name.startswith('range_') and int(name[6:18]) >= from_pos:
+                os.remove(os.path.join(self.parts_dir, name))
+    
+    def write_part(self, range_start: int, arrays: Dict[str, np.ndarray]):
+        """
+        Write the scored pairs of one df1 range.
+        
+        Args:
+            range_start: First df1 position of the range
+            arrays: Arrays named as in ARRAYS
+        """
+        np.savez(os.path.join(self.parts_dir, f'range_{range_start:012d}.npz'), **arrays)
+    
+    def consolidate(self, meta: Dict[str, Any]):
+        """
+        Merge the part files into one memory-mappable array per field.
+        
+        Args:
+            meta: Description of the run, written to meta.json
+        """
+        part_files = sorted(os.listdir(self.parts_dir))
+        sizes = []
+        n_mappings = len(meta['mappings'])
+        for name in part_files:
+            with np.load(os.path.join(self.parts_dir, name)) as part:
+                sizes.append(len(part['pk_score']))
+        total = sum(sizes)
+        
+        outputs = {
+            'df1_row': np.lib.format.open_memmap(os.path.join(self.path, 'df1_row.npy'), 'w+', np.int64, (total,)),
+            'df2_row': np.lib.format.open_memmap(os.path.join(self.path, 'df2_row.npy'), 'w+', np.int64, (total,)),
+            'pk_score': np.lib.format.open_memmap(os.path.join(self.path, 'pk_score.npy'), 'w+', np.uint8, (total,)),
+            'mapping_scores': np.lib.format.open_memmap(os.path.join(self.path, 'mapping_scores.npy'), 'w+',
+                                                        np.uint8, (total, n_mappings)),
+        }
+        offset = 0
+        for name, size in zip(part_files, sizes):
+            with np.load(os.path.join(self.parts_dir, name)) as part:
+                for field, output in outputs.items():
+                    output[offset:offset + size] = part[field]
+            offset += size
+        for output in outputs.values():
+            output.flush()
+        del outputs
+        
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, pairs=total), f, indent=2)
+        for name in part_files:
+            os.remove(os.path.join(self.parts_dir, name))
+        os.rmdir(self.parts_dir)
+    
+    def load(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """
+        Open a consolidated store.
+        
+        Returns:
+            Tuple of (meta dict, arrays memory-mapped read-only)
+        """
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {field: np.load(os.path.join(self.path, f'{field}.npy'), mmap_mode='r')
+                  for field in self.ARRAYS}
+        return meta, arrays
+
+
+def indel_distance(a: str, b: str) -> int:
+    """
+    Insertion/deletion edit distance, len(a) + len(b) - 2 * LCS(a, b).
+    
+    Uses the bit-parallel LCS algorithm on Python integers, so the cost is
+    one big-integer step per character of b.
+    
+    Args:
+        a: First string
+        b: Second string
+        
+    Returns:
+        Number of insertions and deletions turning a into b
+    """
+    if not a or not b:
+        return len(a) + len(b)
+    masks = {}
+    for i, char in enumerate(a):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for char in b:
+        u = v & masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+    lcs = len(a) - bin(v).count('1')
+    return len(a) + len(b) - 2 * lcs
+
+
+def _within_ratio_bound(distance: int, total_length: int, threshold: int) -> bool:
+    """
+    Whether two strings at this indel distance can still reach threshold.
+    
+    fuzz.ratio is round(100 * 2M / T) with M <= LCS, so a score of at least t
+    needs T - 2 * LCS <= T * (100.5 - t) / 100.
+    """
+    return distance * 200 <= total_length * (201 - 2 * threshold)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over distinct key values under indel distance.
+    
+    A query for all keys within distance d of a value only descends into
+    children whose edge distance k satisfies |k - dist| <= d, so short keys
+    with a high threshold touch a small part of the tree.
+    """
+    
+    def __init__(self, values: List[str]):
+        """
+        Build the tree.
+        
+        Args:
+            values: Key values; their positions are returned by query()
+        """
+        self.positions = {}
+        self._words = []
+        self._children = []
+        for pos, value in enumerate(values):
+            if value in self.positions:
+                self.positions[value].append(pos)
+                continue
+            self.positions[value] = [pos]
+            self._insert(value)
+    
+    def _insert(self, value: str):
+        self._words.append(value)
+        self._children.append({})
+        node_id = len(self._words) - 1
+        if node_id == 0:
+            return
+        node = 0
+        while True:
+            distance = indel_distance(value, self._words[node])
+            child = self._children[node].get(distance)
+            if child is None:
+                self._children[node][distance] = node_id
+                return
+            node = child
+    
+    def query(self, value: str, threshold: int, max_length: int) -> List[int]:
+        """
+        Find the positions of every key that can reach threshold against value.
+        
+        The search radius is the indel distance bound for the longest key
+        allowed by the length bound; each hit is then checked against the
+        bound for its own length, so no key that could score at least
+        threshold is left out.
+        
+        Args:
+            value: Lowercased df1 key
+            threshold: Minimum similarity score (0-100)
+            max_length: Length of the longest indexed key
+            
+        Returns:
+            Positions of the candidate keys, unordered
+        """
+        len1 = len(value)
+        if threshold <= 0.5:
+            return [pos for positions in self.positions.values() for pos in positions]
+        if not self._words:
+            return []
+        longest = min(max_length, math.ceil(len1 * (200.5 - threshold) / (threshold - 0.5)))
+        radius = math.floor((len1 + longest) * (100.5 - threshold) / 100)
+        
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            word = self._words[node]
+            distance = indel_distance(value, word)
+            if distance <= radius and _within_ratio_bound(distance, len1 + len(word), threshold):
+                found.extend(self.positions[word])
+            for edge, child in self._children[node].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+_SOUNDEX_DIGITS = {char: digit for letters, digit in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'),
+                                                      ('l', '4'), ('mn', '5'), ('r', '6'))
+                   for char in letters}
+
+
+def soundex(token: str) -> str:
+    """
+    American Soundex code of a word, e.g. 'Robert' -> 'R163'.
+    
+    Args:
+        token: Word to encode; characters other than a-z are ignored
+        
+    Returns:
+        Four character code, or '' if the word has no letters
+    """
+    letters = [char for char in token.lower() if 'a' <= char <= 'z']
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = _SOUNDEX_DIGITS.get(letters[0], '')
+    for char in letters[1:]:
+        digit = _SOUNDEX_DIGITS.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code, vowels do
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def soundex_codes(value: str) -> set:
+    """
+    Soundex codes of every word in a value.
+    
+    Args:
+        value: Text such as a person or company name
+        
+    Returns:
+        Set of codes; words without letters are skipped
+    """
+    return {code for code in map(soundex, re.split(r'[^0-9a-zA-Z]+', value)) if code}
+
+
+class SoundexIndex:
+    """
+    Inverted index from the Soundex code of each word to the rows containing it.
+    
+    'John Doe' and 'John D.' share the codes J500 and D000, so name variants
+    that differ too much for a length or edit-distance bound are still
+    returned as candidates. Candidates sharing no code are missed, so this is
+    an approximate source.
+    """
+    
+    def __init__(self, values: List[str]):
+        """
+        Build the index.
+        
+        Args:
+            values: Values to index; their positions are returned by query()
+        """
+        self.postings = {}
+        for pos, value in enumerate(values):
+            for code in soundex_codes(value):
+                self.postings.setdefault(code, []).append(pos)
+    
+    def query(self, value: str, threshold: int, max_length: int) -> List[int]:
+        """
+        Find the positions of every value sharing a word code with value.
+        
+        Args:
+            value: Value to look up
+            threshold: Unused; phonetic codes do not depend on it
+            max_length: Unused
+            
+        Returns:
+            Positions of the candidate values, unordered and possibly repeated
+        """
+        found = []
+        for code in soundex_codes(value):
+            found.extend(self.postings.get(code, ()))
+        return found
+
+
+# Candidate indexes that process_mappings(candidate_sources=...) can build over
+# the df2 keys. Each takes the key values and answers query(value, threshold,
+# max_length) with candidate positions.
+CANDIDATE_SOURCES = {
+    'bktree': BKTree,
+    'soundex': SoundexIndex,
+}
+
+
+class CandidateKeys:
+    """
+    Materialized df2 keys together with the candidate indexes built over them.
+    
+    Instead of scanning every df2 key, a df1 key is only scored against the
+    union of the candidates the indexes return. A source is either a name
+    from CANDIDATE_SOURCES, indexing the primary key, or 'name:source_expr',
+    indexing the df2 values of that mapping (e.g. 'soundex:a2' for a2 -> b5)
+    and looked up with the df1 row's source_expr value.
+    """
+    
+    def __init__(self, keys: Tuple[List[Any], List[str], List[int]], sources: List[str],
+                 field_values: Optional[Dict[str, List[str]]] = None):
+        """
+        Build the candidate indexes.
+        
+        Args:
+            keys: Materialized keys (labels, lowercased values, lengths)
+            sources: Candidate source specs, 'name' or 'name:source_expr'
+            field_values: Lowercased df2 values of each mapping source_expr used by sources
+        """
+        specs = [spec.partition(':')[::2] for spec in sources]
+        unknown = [name for name, _ in specs if name not in CANDIDATE_SOURCES]
+        if unknown:
+            raise ValueError(f"Unknown candidate source(s): {', '.join(unknown)}")
+        self.labels, self.values, self.lengths = keys
+        self.sources = list(sources)
+        self.fields = sorted({field for _, field in specs if field})
+        self.max_length = max(self.lengths, default=0)
+        self.indexes = []
+        for name, field in specs:
+            values = field_values[field] if field else self.values
+            max_length = max(map(len, values), default=0) if field else self.max_length
+            self.indexes.append((field, max_length, CANDIDATE_SOURCES[name](values)))
+    
+    def __len__(self) -> int:
+        return len(self.labels)
+    
+    def candidates(self, value1: str, threshold: int,
+                   fields1: Optional[Dict[str, str]] = None) -> List[Tuple[Any, str, int]]:
+        """
+        Collect the candidates for one df1 row.
+        
+        Args:
+            value1: Lowercased df1 key
+            threshold: Minimum similarity score (0-100)
+            fields1: df1 row values of the mapping fields in self.fields
+            
+        Returns:
+            List of (df2 index label, lowercased key, key length) in df2 row order,
+            so ties resolve to the same row as a full scan
+        """
+        positions = set()
+        for field, max_length, index in self.indexes:
+            query_value = fields1[field].lower() if field else value1
+            positions.update(index.query(query_value, threshold, max_length))
+        return [(self.labels[pos], self.values[pos], self.lengths[pos]) for pos in sorted(positions)]
+
+
+_CURRENCY_ALIASES = {'$': 'USD', 'us$': 'USD', 'usd': 'USD', '€': 'EUR', 'eur': 'EUR', '£': 'GBP',
+                     'gbp': 'GBP', '₹': 'INR', 'rs': 'INR', 'rs.': 'INR', 'inr': 'INR', '¥': 'JPY'}
+
+_COUNTRY_ALIASES = {'united states': 'US', 'united states of america': 'US', 'usa': 'US', 'u.s.': 'US',
+                    'u.s.a.': 'US', 'america': 'US', 'united kingdom': 'GB', 'uk': 'GB',
+                    'great britain': 'GB', 'england': 'GB', 'india': 'IN', 'germany': 'DE',
+                    'deutschland': 'DE', 'france': 'FR', 'china': 'CN', 'japan': 'JP', 'canada': 'CA',
+                    'australia': 'AU', 'united arab emirates': 'AE', 'uae': 'AE', 'singapore': 'SG'}
+
+
+def normalize_text(value: str) -> str:
+    """Case- and whitespace-insensitive form of a value for exact comparison."""
+    return ' '.join(value.lower().split())
+
+
+def normalize_currency(value: str) -> str:
+    """Currency code of a value, e.g. '$' or 'usd' -> 'USD'."""
+    value = value.strip()
+    return _CURRENCY_ALIASES.get(value.lower(), value.upper())
+
+
+def normalize_country(value: str) -> str:
+    """Country code of a value, e.g. 'United Kingdom' or 'uk' -> 'GB'."""
+    value = normalize_text(value)
+    return _COUNTRY_ALIASES.get(value, value.upper())
+
+
+def normalize_amount(value: str) -> str:
+    """
+    Amount rounded to cents, ignoring currency symbols and thousands separators.
+    
+    Args:
+        value: Amount text such as '$1,234.5'
+        
+    Returns:
+        Normalized amount such as '1234.50', or '' if it is not a number
+    """
+    cleaned = re.sub(r'[^0-9.\-]', '', value)
+    try:
+        return f"{float(cleaned):.2f}"
+    except ValueError:
+        return ''
+
+
+# Result column layouts of process_mappings(output_profile=...)
+OUTPUT_PROFILES = ('full', 'scores', 'refs')
+
+# Comparators for cascade pairing, chosen per mapping with the optional
+# 'comparator' column of the mapping file. Filter comparators compare
+# normalized values for equality through a hash index; fuzzy comparators
+# score (cost, scorer) and run cheapest first.
+FILTER_COMPARATORS = {
+    'exact': normalize_text,
+    'currency': normalize_currency,
+    'country': normalize_country,
+    'amount': normalize_amount,
+}
+
+FUZZY_COMPARATORS = {
+    'fuzzy': (1, fuzz.ratio),
+    'token_sort': (2, fuzz.token_sort_ratio),
+    'token_set': (3, fuzz.token_set_ratio),
+    'partial': (4, fuzz.partial_ratio),
+}
+
+
+def _report_writer_main(output_path: str, batches: 'multiprocessing.Queue'):
+    """
+    Writer process of ReportPipeline: stream queued rows into a write-only workbook.
+    
+    Messages are ('header', columns), ('rows', rows), ('finish', sheets) with
+    sheets as a list of (sheet name, columns, rows), and ('abort', None).
+    
+    Args:
+        output_path: Path of the xlsx report
+        batches: Queue to read messages from
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    results_sheet = workbook.create_sheet('Match Results')
+    bold = openpyxl.styles.Font(bold=True)
+    
+    def header_cells(sheet, columns):
+        cells = []
+        for name in columns:
+            cell = openpyxl.cell.WriteOnlyCell(sheet, value=name)
+            cell.font = bold
+            cells.append(cell)
+        return cells
+    
+    while True:
+        kind, payload = batches.get()
+        if kind == 'header':
+            results_sheet.append(header_cells(results_sheet, payload))
+        elif kind == 'rows':
+            for row in payload:
+                results_sheet.append(row)
+        elif kind == 'finish':
+            for sheet_name, columns, rows in payload:
+                sheet = workbook.create_sheet(sheet_name)
+                sheet.append(header_cells(sheet, columns))
+                for row in rows:
+                    sheet.append(row)
+            workbook.save(output_path)
+            return
+        else:
+            return
+
+
+class ReportPipeline:
+    """
+    Writes the match report in a separate process while matching continues.
+    
+    Result batches go through a bounded queue, so a writer that falls behind
+    blocks the matcher instead of letting batches pile up in memory.
+    """
+    
+    def __init__(self, output_path: str, columns: List[str], max_batches: int = 4):
+        """
+        Start the writer process.
+        
+        Args:
+            output_path: Path of the xlsx report
+            columns: Columns of the Match Results sheet
+            max_batches: Number of result batches that may wait in the queue
+        """
+        self.output_path = output_path
+        self.columns = list(columns)
+        self.batches = multiprocessing.Queue(maxsize=max_batches)
+        self.writer = multiprocessing.Process(target=_report_writer_main, args=(output_path, self.batches),
+                                              daemon=True)
+        self.writer.start()
+        self._put(('header', self.columns))
+    
+    def _put(self, message: Tuple[str, Any]):
+        """
+        Queue a message, waiting while the queue is full.
+        
+        Args:
+            message: Message for _report_writer_main
+        """
+        while True:
+            try:
+                self.batches.put(message, timeout=1)
+                return
+            except queue.Full:
+                if not self.writer.is_alive():
+                    raise RuntimeError(f"Report writer for {self.output_path} exited with code {self.writer.exitcode}")
+    
+    def send(self, frame: pd.DataFrame):
+        """
+        Queue a batch of result rows.
+        
+        Args:
+            frame: Results with the pipeline's columns
+        """
+        if len(frame):
+            self._put(('rows', frame[self.columns].astype(object).values.tolist()))
+    
+    def finish(self, sheets: List[Tuple[str, pd.DataFrame]]):
+        """
+        Add the remaining sheets, save the workbook and wait for the writer.
+        
+        Args:
+            sheets: (sheet name, DataFrame) pairs written after Match Results
+        """
+        self._put(('finish', [(name, [str(column) for column in df.columns],
+                               df.astype(object).where(df.notna(), None).values.tolist())
+                              for name, df in sheets]))
+        self.writer.join()
+        if self.writer.exitcode != 0:
+            raise RuntimeError(f"Report writer for {self.output_path} exited with code {self.writer.exitcode}")
+    
+    def abort(self):
+        """Stop the writer without saving the report."""
+        if self.writer.is_alive():
+            try:
+                self.batches.put(('abort', None), timeout=1)
+            except queue.Full:
+                self.writer.terminate()
+            self.writer.join()
+
+
+def allocate_sample(sizes: List[int], sample_size: int) -> List[int]:
+    """
+    Split a sample proportionally over strata by the largest remainder method.
+    
+    Every stratum gets at least one row, so there must be no more strata than
+    sample_size (see estimate_match_rate, which merges small strata).
+    
+    Args:
+        sizes: Number of rows in each stratum
+        sample_size: Total number of rows to sample, at most sum(sizes)
+        
+    Returns:
+        Rows to sample from each stratum, summing to sample_size
+    """
+    population = sum(sizes)
+    if not sample_size or not population:
+        return [0] * len(sizes)
+    quotas = [sample_size * size / population for size in sizes]
+    allocation = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(sizes)), key=lambda i: quotas[i] - allocation[i], reverse=True)
+    for i in by_remainder[:sample_size - sum(allocation)]:
+        allocation[i] += 1
+    
+    # Give empty-handed strata a row from the stratum with the most
+    for i, n in enumerate(allocation):
+        if n == 0:
+            donor = max(range(len(allocation)), key=lambda j: allocation[j])
+            allocation[donor] -= 1
+            allocation[i] = 1
+    return allocation
+
+
 class ExcelFuzzyMapper:
-    def __init__(self, excel1_path: str, excel2_path: str, mapping_excel_path: str):
+    # Text columns with at most this share of distinct values become categoricals
+    # under the low_memory load profile
+    LOW_CARDINALITY_RATIO = 0.5
+    
+    def __init__(self, excel1_path: Optional[str], excel2_path: str, mapping_excel_path: str,
+                 load_profile: str = 'default', parallel_load: bool = False,
+                 reference_cache: Optional[Dict[Any, Any]] = None,
+                 reference_store: Optional[str] = None, profile_memory: bool = False,
+                 sheet_name: Union[str, int] = 0):
+        """
+        Initialize the mapper with paths to three Excel files.
+        
+        CSV and Parquet files are accepted too and are read by file extension
+        (see read_table). CSV and Parquet data files are projected to the
+        columns referenced by the mapping file.
+        
+        Args:
+            excel1_path: Path to first Excel file (with a1, a2, a3... columns), or
+                None for a reference-only mapper used through match_records
+            excel2_path: Path to second Excel file (with b1, b2, b3... columns)
+            mapping_excel_path: Path to mapping Excel file
+            load_profile: 'default' keeps the frames as loaded; 'low_memory' drops
+                unmapped columns and stores mapped text columns as Arrow-backed
+                strings or categoricals
+            parallel_load: Parse the two data files at the same time in worker processes
+            reference_cache: Optional dict shared between mappers that keeps the
+                loaded excel2 frame and its primary key index for reuse
+            reference_store: Optional SQLite file to keep df2's keys and mapping
+                values in instead of memory (see ReferenceStore). It is built
+                on first use and rebuilt when excel2 or the mapping changes.
+            profile_memory: Record the allocation peak and top allocation sites
+                of every phase (see MatchMetrics.memory_summary). The profile is
+                part of the metrics JSON written by process_mappings.
+            sheet_name: Sheet to read from Excel data files, by name or position
+                (default: the first sheet). See reconcile_sheets for running
+                several sheets.
+        """
+        if load_profile not in ('default', 'low_memory'):
+            raise ValueError(f"Unknown load profile: {load_profile}")
+        
+        self.excel1_path = excel1_path
+        self.excel2_path = excel2_path
+        self.mapping_excel_path = mapping_excel_path
+        self.sheet_name = sheet_name
+        self.reference_cache = reference_cache
+        self.reference_store = None
+        
+        self.metrics = MatchMetrics(profile_memory=profile_memory)
+        self.metrics_path = None
+        
+        # Load the files. The mapping file is small and goes first so the data
+        # files can be projected to the mapped columns.
+        with self.metrics.phase('load'):
+            self.mapping_df = read_table(mapping_excel_path)
+            mapped_cols = list(self._mapped_columns())
+            self.df2 = self._cache_get(('frame', frozenset(mapped_cols[1])))
+            if reference_store is not None:
+                self.reference_store = self._open_reference_store(reference_store, mapped_cols[1])
+            if parallel_load and self.df2 is None and excel1_path is not None and reference_store is None:
+                self.df1, self.df2 = load_frames_parallel([excel1_path, excel2_path], mapped_cols, sheet_name)
+            else:
+                if excel1_path is not None:
+                    self.df1 = read_table(excel1_path, mapped_cols[0], sheet_name)
+                else:
+                    self.df1 = pd.DataFrame(columns=sorted(mapped_cols[0]))
+                if self.df2 is None and reference_store is None:
+                    self.df2 = read_table(excel2_path, mapped_cols[1], sheet_name)
+        
+        # Ensure column names are strings
+        self.df1.columns = self.df1.columns.astype(str)
+        if self.df2 is not None:
+            self.df2.columns = self.df2.columns.astype(str)
+            self._cache_put(('frame', frozenset(mapped_cols[1])), self.df2)
+        
+        self.memory_report = None
+        if load_profile == 'low_memory':
+            self.memory_report = self._apply_low_memory_profile()
+    
+    def _cache_get(self, key: Tuple) -> Any:
+        """
+        Look up an excel2-derived object in the reference cache.
+        
+        Args:
+            key: Cache key, qualified here with the excel2 file identity
+            
+        Returns:
+            The cached object, or None
+        """
+        if self.reference_cache is None:
+            return None
+        return self.reference_cache.get(self._reference_identity() + key)
+    
+    def _cache_put(self, key: Tuple, value: Any):
+        """
+        Store an excel2-derived object in the reference cache.
+        
+        Args:
+            key: Cache key, qualified here with the excel2 file identity
+            value: Object to store
+        """
+        if self.reference_cache is not None:
+            self.reference_cache[self._reference_identity() + key] = value
+    
+    def _reference_identity(self) -> Tuple:
+        """
+        Identify the excel2 file so a changed file is not served from cache.
+        
+        Returns:
+            Tuple of (absolute path, size, modification time, sheet)
+        """
+        stat = os.stat(self.excel2_path)
+        return (os.path.abspath(self.excel2_path), stat.st_size, stat.st_mtime_ns, self.sheet_name)
+    
+    def _open_reference_store(self, db_path: str, target_cols: set) -> 'ReferenceStore':
+        """
+        Open the on-disk reference store, (re)building it from excel2 if it was
+        built from a different file version, mapping or reader version.
+        
+        The store is built with iter_table_chunks, which reads values exactly
+        like read_table, so results do not depend on whether the store is used.
+        
+        Args:
+            db_path: Path to the SQLite database file
+            target_cols: df2 columns referenced by the mapping
+            
+        Returns:
+            The ReferenceStore
+        """
+        pk_target_cols = self.parse_mapping_expression(str(self.mapping_df.iloc[0]['target_column']))
+        value_exprs = list(dict.fromkeys(target_expr for _, target_expr, _, _ in self._compile_mapping_plan()))
+        source = json.loads(json.dumps({'reference': self._reference_identity(),
+                                        'reader': TABLE_READER_VERSION,
+                                        'pk_target_cols': pk_target_cols,
+                                        'value_exprs': value_exprs}))
+        
+        store = ReferenceStore(db_path)
+        meta = store.meta()
+        if meta is not None and {key: meta.get(key) for key in source} == source:
+            return store
+        
+        print(f"Building reference store {db_path} from {self.excel2_path}")
+        value_cols = [self.parse_mapping_expression(expr) for expr in value_exprs]
+        
+        def rows():
+            for chunk in iter_table_chunks(self.excel2_path, target_cols, sheet_name=self.sheet_name):
+                chunk.columns = chunk.columns.astype(str)
+                for idx in chunk.index:
+                    yield (int(idx),
+                           self.get_concatenated_value(chunk, pk_target_cols, idx).lower(),
+                           [self.get_concatenated_value(chunk, cols, idx) for cols in value_cols])
+        
+        store.build(source, value_exprs, rows())
+        return store
+    
+    def reference_rows(self) -> int:
+        """
+        Number of rows in the reference (df2), in memory or in the store.
+        
+        Returns:
+            Row count
+        """
+        return len(self.reference_store) if self.reference_store is not None else len(self.df2)
+    
+    def _reference_keys(self, pk_target_cols: List[str],
+                         candidate_sources: Optional[List[str]] = None) -> Any:
+        """
+        Get the materialized df2 primary key index, reusing a cached one.
+        
+        Args:
+            pk_target_cols: Primary key columns in df2
+            candidate_sources: Optional names from CANDIDATE_SOURCES to index the keys with
+            
+        Returns:
+            Materialized df2 keys from _materialize_keys, CandidateKeys when
+            candidate_sources are given, or the ReferenceStore when df2 lives on disk
+        """
+        if self.reference_store is not None:
+            return self.reference_store
+        keys2 = self._cache_get(('keys', tuple(pk_target_cols)))
+        if keys2 is None:
+            keys2 = self._materialize_keys(self.df2, pk_target_cols)
+            self._cache_put(('keys', tuple(pk_target_cols)), keys2)
+        if candidate_sources:
+            cache_key = ('candidates', tuple(pk_target_cols), tuple(candidate_sources))
+            indexed = self._cache_get(cache_key)
+            if indexed is None:
+                targets = {source_expr: target_expr for source_expr, target_expr, _, _
+                           in self._compile_mapping_plan()}
+                field_values = {}
+                for spec in candidate_sources:
+                    field = spec.partition(':')[2]
+                    if field and field not in targets:
+                        raise ValueError(f"Candidate source {spec}: no mapping with source column {field}")
+                    if field and field not in field_values:
+                        target_cols = self.parse_mapping_expression(targets[field])
+                        field_values[field] = self._materialize_keys(self.df2, target_cols)[1]
+                indexed = CandidateKeys(keys2, candidate_sources, field_values)
+                self._cache_put(cache_key, indexed)
+            return indexed
+        return keys2
+    
+    def _mapped_columns(self) -> Tuple[set, set]:
+        """
+        Collect the columns referenced by the mapping file.
+        
+        Returns:
+            Tuple of (df1 column names, df2 column names)
+        """
+        source_cols = set()
+        target_cols = set()
+        for _, mapping_row in self.mapping_df.iterrows():
+            source_cols.update(self.parse_mapping_expression(str(mapping_row['source_column'])))
+            target_cols.update(self.parse_mapping_expression(str(mapping_row['target_column'])))
+        return source_cols, target_cols
+    
+    def _apply_low_memory_profile(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Shrink df1 and df2 to the mapped columns with compact text dtypes.
+        
+        Unmapped columns are dropped. Mapped text columns become categoricals
+        when they have few distinct values and Arrow-backed strings otherwise
+        (plain pandas strings if pyarrow is not installed).
+        
+        The "loaded" figure is measured on the frames as read. read_table
+        already reads only the mapped columns of CSV and Parquet inputs, so
+        for those it leaves out what that projection saved and the difference
+        only covers the dtype changes here.
+        
+        Returns:
+            Dict with rows, bytes per row as loaded and after, and whether the
+            frame was already projected to the mapped columns on load, per frame
+        """
+        try:
+            import pyarrow  # noqa: F401
+            string_dtype = pd.StringDtype('pyarrow')
+        except ImportError:
+            string_dtype = pd.StringDtype()
+        
+        report = {}
+        for name, used_cols in zip(('df1', 'df2'), self._mapped_columns()):
+            df = getattr(self, name)
+            if df is None:
+                continue
+            rows = max(len(df), 1)
+            loaded = df.memory_usage(deep=True).sum() / rows
+            projected = all(col in used_cols for col in df.columns)
+            
+            df = df[[col for col in df.columns if col in used_cols]].copy()
+            for col in df.columns:
+                dtype = df[col].dtype
+                if not (pd.api.types.is_object_dtype(dtype) or isinstance(dtype, pd.StringDtype)):
+                    continue
+                if df[col].nunique(dropna=True) <= self.LOW_CARDINALITY_RATIO * len(df):
+                    df[col] = df[col].astype('category')
+                else:
+                    df[col] = df[col].astype(string_dtype)
+            
+            after = df.memory_usage(deep=True).sum() / rows
+            setattr(self, name, df)
+            report[name] = {'rows': len(df), 'bytes_per_row_loaded': round(loaded, 1),
+                            'bytes_per_row_after': round(after, 1), 'projected_on_load': projected}
+            print(f"{name}: {loaded:,.1f} bytes per row as loaded"
+                  f"{' (already mapped columns only)' if projected else ''} -> "
+                  f"{after:,.1f} over {len(df):,} rows ({len(df.columns)} mapped columns kept)")
+        return report
+    
+    def parse_mapping_expression(self, expr: str) -> List[str]:
+        """
+        Parse mapping expressions like 'a10+a12' into ['a10', 'a12']
+        
+        Args:
+            expr: Expression string (e.g., 'a10+a12' or 'a1')
+            
+        Returns:
+            List of column names
+        """
+        # Remove spaces and split by '+'
+        columns = expr.strip().replace(' ', '').split('+')
+        return columns
+    
+    def get_concatenated_value(self, df: pd.DataFrame, columns: List[str], row_idx: int) -> str:
+        """
+        Get concatenated value from multiple columns for a specific row.
+        
+        Args:
+            df: DataFrame to get values from
+            columns: List of column names
+            row_idx: Row index
+            
+        Returns:
+            Concatenated string value
+        """
+        values = []
+        for col in columns:
+            if col in df.columns:
+                val = df.loc[row_idx, col]
+                if pd.notna(val):
+                    values.append(str(val))
+            else:
+                self.metrics.diagnostics.warning(('missing_column', col),
+                                                 "Column '%s' not found in DataFrame", col)
+                break
+        
+        return ' '.join(values)
+    
+    def fuzzy_match_rows(self, str1: str, str2: str, threshold: int = 80) -> Tuple[bool, int]:
+        """
+        Perform case-insensitive fuzzy matching between two strings.
+        
+        Args:
+            str1: First string
+            str2: Second string
+            threshold: Minimum similarity score (0-100)
+            
+        Returns:
+            Tuple of (is_match, similarity_score)
+        """
+        # Convert to string, handle None values, and convert to lowercase
+        str1 = str(str1).lower() if pd.notna(str1) else ''
+        str2 = str(str2).lower() if pd.notna(str2) else ''
+        
+        # Calculate similarity score on lowercase strings
+        score = fuzz.ratio(str1, str2)
+        
+        return score >= threshold, score
+    
+    def process_mappings(self, threshold: int = 80, checkpoint_path: Optional[str] = None,
+                         checkpoint_every: int = 1000, show_progress: bool = True,
+                         metrics_path: Optional[str] = None, bidirectional: bool = False,
+                         score_store_path: Optional[str] = None,
+                         score_floor: Optional[int] = None,
+                         candidate_sources: Optional[List[str]] = None,
+                         pairing: str = 'primary_key', report_path: Optional[str] = None,
+                         report_queue_size: int = 4, output_profile: str = 'full',
+                         keep_results: bool = True) -> pd.DataFrame:
+        """
+        Process all mappings and perform fuzzy matching.
+        
+        Args:
+            threshold: Minimum similarity score for matching (0-100)
+            checkpoint_path: Optional file to checkpoint completed df1 row ranges to.
+                A rerun with the same inputs and threshold resumes from it.
+            checkpoint_every: Number of df1 rows per checkpointed range
+            show_progress: Show a live progress line on stderr
+            metrics_path: Optional path to write run metrics to as JSON
+            bidirectional: Also track each df2 row's best df1 row in the same
+                candidate pass and flag whether every pair is a mutual best
+            score_store_path: Optional directory to save every scored candidate
+                pair at or above score_floor, with its mapping scores, for
+                later re-analysis with reanalyze()
+            score_floor: Lowest primary key score kept in the score store
+                (default: threshold - 10). Pairs down to this score are not
+                pruned, so lower floors make the run slower.
+            candidate_sources: Optional names from CANDIDATE_SOURCES. Each df1 key
+                is then only scored against the union of the df2 keys these
+                indexes return instead of every df2 key. 'bktree' returns every
+                key within the edit distance the threshold allows, so results
+                are the same as a full scan. 'soundex' returns keys sharing a
+                phonetic word code and may miss matches. 'name:source_expr'
+                indexes another mapping's values instead, e.g. 'soundex:a2'.
+            pairing: How each df1 row picks its df2 row. 'primary_key' takes the
+                best primary key score. 'cascade' uses every mapping with a
+                'comparator' in the mapping file (see _compile_cascade): filter
+                comparators narrow the candidates, fuzzy comparators score the
+                survivors cheapest first and drop those below threshold, and the
+                weighted mean of all comparator scores picks the pair. The mean
+                is added as a composite_score column.
+            report_path: Optional xlsx path to write the match report to while
+                matching runs. Each checkpoint range of results is handed to a
+                writer process through a queue, so scoring and xlsx
+                serialization overlap. Same sheets as generate_match_report.
+            report_queue_size: Number of result ranges that may wait for the
+                writer before matching blocks
+            output_profile: Which columns the results keep. 'full' keeps the
+                compared value1_*/value2_* strings; 'scores' leaves them out;
+                'refs' leaves them out too and lets generate_match_report look
+                them up from df1_row_index/df2_row_index when it writes
+                (see resolve_values)
+            keep_results: With report_path, False streams each range of
+                results to the report writer only, without also collecting
+                them here, so memory stays bounded by report_queue_size. The
+                returned DataFrame then has the result columns but no rows.
+            
+        Returns:
+            DataFrame with fuzzy matching results
+        """
+        if score_store_path and bidirectional:
+            raise ValueError("bidirectional cannot be combined with score_store_path; "
+                             "use reanalyze(..., bidirectional=True) on the saved scores instead")
+        if score_floor is None:
+            score_floor = max(threshold - 10, 0)
+        if score_floor > threshold:
+            raise ValueError("score_floor cannot be above threshold")
+        if report_path and bidirectional:
+            raise ValueError("report_path cannot be combined with bidirectional: the mutual-best "
+                             "columns are only known after the last row; use generate_match_report")
+        if not keep_results and not report_path:
+            raise ValueError("keep_results=False needs report_path: the results are only written to the report")
+        if output_profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile: {output_profile}")
+        if pairing not in ('primary_key', 'cascade'):
+            raise ValueError(f"Unknown pairing: {pairing}")
+        if pairing == 'cascade' and (bidirectional or score_store_path or candidate_sources
+                                     or self.reference_store is not None):
+            raise ValueError("cascade pairing cannot be combined with bidirectional, "
+                             "score_store_path, candidate_sources or a reference store")
+        if candidate_sources and self.reference_store is not None:
+            raise ValueError("candidate_sources need the df2 keys in memory and cannot be "
+                             "combined with a reference store")
+
+        print ("DFs :\n")
+        print (f"Excel1: {self.df1.head()}\n")
+        print (f"Excel2: {self.df2.head() if self.df2 is not None else self.reference_store.head()}\n")
+              
+        results = None
+        pipeline = None
+        self.metrics.start_run(len(self.df1), threshold)
+        self.metrics_path = metrics_path
+        
+        # Get primary key mapping (assuming first row contains primary key mapping)
+        if len(self.mapping_df) > 0:
+            primary_key_source = str(self.mapping_df.iloc[0]['source_column'])
+            primary_key_target = str(self.mapping_df.iloc[0]['target_column'])
+            
+            # Parse primary key columns
+            pk_source_cols = self.parse_mapping_expression(primary_key_source)
+            pk_target_cols = self.parse_mapping_expression(primary_key_target)
+            
+            print(f"Primary key mapping: {primary_key_source} -> {primary_key_target}")
+            
+            # Build the df2 primary key values and the mapping plan once, not per row
+            with self.metrics.phase('materialize'):
+                keys2 = self._reference_keys(pk_target_cols, candidate_sources)
+                plan = self._compile_mapping_plan()
+                field_cols = [(field, self.parse_mapping_expression(field))
+                              for field in getattr(keys2, 'fields', [])]
+                cascade = self._compile_cascade() if pairing == 'cascade' else None
+            include_values = output_profile == 'full'
+            results = ResultAccumulator(plan, include_values)
+            
+            # Resume from a previous interrupted run if a matching checkpoint exists
+            start_pos = 0
+            fingerprint = None
+            state = {'reverse_best': {}, 'composite': {}}
+            if checkpoint_path:
+                fingerprint = self._run_fingerprint(threshold, bidirectional=bidirectional,
+                                                    score_store_path=score_store_path,
+                                                    score_floor=score_floor if score_store_path else None,
+                                                    candidate_sources=candidate_sources,
+                                                    pairing=pairing, output_profile=output_profile)
+                start_pos, checkpoint_end = self._load_checkpoint(checkpoint_path, fingerprint, results, state)
+                if start_pos > 0:
+                    # Drop any torn or out-of-order records after the last good
+                    # range, so the ranges appended by this run can be read back
+                    with open(checkpoint_path, 'r+b') as f:
+                        f.truncate(checkpoint_end)
+                    print(f"Resuming from checkpoint {checkpoint_path}: {start_pos} of {len(self.df1)} rows already done")
+            self.metrics.rows_resumed = start_pos
+            self.metrics.matched_rows = len(results)
+            
+            score_store = None
+            if score_store_path:
+                score_store = ScoreStore(score_store_path)
+                score_store.reset_parts(start_pos)
+            
+            if report_path:
+                columns = list(ResultAccumulator(plan).kinds if output_profile == 'refs' else results.kinds)
+                if pairing == 'cascade':
+                    columns.insert(columns.index('primary_key_score') + 1, 'composite_score')
+                pipeline = ReportPipeline(report_path, columns, report_queue_size)
+            
+            try:
+                if pipeline is not None:
+                    with self.metrics.phase('report'):
+                        pipeline.send(self._results_frame(results, state, pairing, output_profile))
+                    if not keep_results:
+                        results = ResultAccumulator(plan, include_values)
+                
+                # Process df1 in ranges of checkpoint_every rows
+                for range_start in range(start_pos, len(self.df1), checkpoint_every):
+                    range_end = min(range_start + checkpoint_every, len(self.df1))
+                
+                    # Pair each df1 row with its best df2 row by primary key
+                    pairs = []
+                    scored_pairs = [] if score_store is not None else None
+                    range_state = {'reverse_best': {}, 'composite': {}}
+                    with self.metrics.phase('match'):
+                        for pos in range(range_start, range_end):
+                            idx1 = self.df1.index[pos]
+                            pk_value1 = self.get_concatenated_value(self.df1, pk_source_cols, idx1)
+                            fields1 = {field: self.get_concatenated_value(self.df1, cols, idx1)
+                                       for field, cols in field_cols} if field_cols else None
+                            if cascade is not None:
+                                best_match_idx, best_match_score, composite = self._find_best_match_cascade(
+                                    idx1, cascade, threshold)
+                                if best_match_idx is not None:
+                                    range_state['composite'][idx1] = composite
+                            elif bidirectional:
+                                best_match_idx, best_match_score = self._find_best_match_bidirectional(
+                                    pk_value1, idx1, keys2, threshold, state['reverse_best'],
+                                    range_state['reverse_best'], fields1)
+                            elif score_store is not None:
+                                row_pairs = []
+                                best_match_idx, best_match_score = self._find_best_match(
+                                    pk_value1, keys2, threshold, score_floor, row_pairs, fields1)
+                                scored_pairs.extend((idx1, idx2, score) for idx2, score in row_pairs)
+                            else:
+                                best_match_idx, best_match_score = self._find_best_match(
+                                    pk_value1, keys2, threshold, fields1=fields1)
+                        
+                            if best_match_idx is not None:
+                                pairs.append((idx1, best_match_idx, best_match_score, pk_value1))
+                            self.metrics.row_done(best_match_idx is not None, show_progress)
+                
+                    # Process all other column mappings for the matched pairs
+                    range_results = ResultAccumulator(plan, include_values)
+                    with self.metrics.phase('secondary'):
+                        for pair in pairs:
+                            self._compare_mappings(plan, range_results, *pair, threshold)
+                        if score_store is not None:
+                            score_store.write_part(range_start, self._score_pairs(plan, scored_pairs))
+                
+                    if keep_results:
+                        results.extend(range_results)
+                        state['composite'].update(range_state['composite'])
+                    if pipeline is not None:
+                        with self.metrics.phase('report'):
+                            pipeline.send(self._results_frame(range_results, range_state, pairing, output_profile))
+                
+                    if checkpoint_path:
+                        self._append_checkpoint(checkpoint_path, fingerprint, range_start, range_end,
+                                                range_results, range_state)
+            
+                if score_store is not None:
+                    score_store.consolidate({
+                        'threshold': threshold,
+                        'score_floor': score_floor,
+                        'inputs': self._inputs_digest(),
+                        'mappings': [[source_expr, target_expr] for source_expr, target_expr, _, _ in plan],
+                    })
+            
+                # The run completed, so the checkpoint is no longer needed
+                if checkpoint_path and os.path.exists(checkpoint_path):
+                    os.remove(checkpoint_path)
+            except BaseException:
+                if pipeline is not None:
+                    pipeline.abort()
+                raise
+        
+        with self.metrics.phase('dataframe'):
+            if results is not None:
+                results_df = self._results_frame(results, state, pairing)
+                results_df.attrs['output_profile'] = output_profile
+            else:
+                results_df = pd.DataFrame()
+            if bidirectional and results is not None:
+                self._add_mutual_best_columns(results_df, state['reverse_best'])
+        
+        self.metrics.finish(show_progress)
+        self.metrics.diagnostics.flush()
+        if metrics_path:
+            self.metrics.write_json(metrics_path)
+        
+        if report_path:
+            if pipeline is None:
+                self.generate_match_report(results_df, report_path)
+            else:
+                with self.metrics.phase('report'):
+                    matched_rows = None if keep_results else self.metrics.matched_rows
+                    pipeline.finish([('Summary', self._summary_frame(results_df, matched_rows)),
+                                     ('Mapping Configuration', self.mapping_df)])
+                if metrics_path:
+                    self.metrics.write_json(metrics_path)
+                print(f"Match report saved to: {report_path}")
+        
+        return results_df
+    
+    def _results_frame(self, results: 'ResultAccumulator', state: Dict[str, Dict],
+                       pairing: str, output_profile: str = 'full') -> pd.DataFrame:
+        """
+        Build a results DataFrame, adding the composite score for cascade pairing.
+        
+        Args:
+            results: Accumulated results
+            state: Run state holding the 'composite' score of each df1 row
+            pairing: Pairing mode of the run
+            output_profile: 'refs' resolves the value columns (for report writing)
+            
+        Returns:
+            Results DataFrame
+        """
+        results_df = results.to_frame()
+        if pairing == 'cascade':
+            results_df.insert(results_df.columns.get_loc('primary_key_score') + 1, 'composite_score',
+                              [state['composite'][idx1] for idx1 in results_df['df1_row_index']])
+        if output_profile == 'refs':
+            results_df = self.resolve_values(results_df)
+        return results_df
+    
+    def resolve_values(self, results_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the value1_*/value2_* columns to results produced without them,
+        looking the values up by df1_row_index and df2_row_index.
+        
+        Args:
+            results_df: Results from process_mappings(output_profile='refs' or 'scores')
+            
+        Returns:
+            Copy of the results in the 'full' column layout
+        """
+        plan = self._compile_mapping_plan()
+        idx1s = results_df['df1_row_index'].tolist()
+        idx2s = results_df['df2_row_index'].tolist()
+        fetched = ([self.reference_store.fetch(idx2) for idx2 in idx2s]
+                   if self.reference_store is not None else None)
+        
+        def encoded(values):
+            return pd.Categorical(values, categories=list(dict.fromkeys(values)))
+        
+        value_columns = {}
+        for source_expr, target_expr, source_cols, target_cols in plan:
+            match_column = f'mapping_{source_expr}_to_{target_expr}_match'
+            values1 = [self.get_concatenated_value(self.df1, source_cols, idx1) for idx1 in idx1s]
+            if fetched is not None:
+                values2 = [values2[target_expr] for values2 in fetched]
+            else:
+                values2 = [self.get_concatenated_value(self.df2, target_cols, idx2) for idx2 in idx2s]
+            value_columns.setdefault(match_column, {})
+            value_columns[match_column][f'value1_{source_expr}'] = encoded(values1)
+            value_columns[match_column][f'value2_{target_expr}'] = encoded(values2)
+        
+        data = {}
+        for column in results_df.columns:
+            data[column] = results_df[column]
+            for name, values in value_columns.get(column, {}).items():
+                data[name] = values
+        resolved = pd.DataFrame(data, index=results_df.index)
+        resolved.attrs['output_profile'] = 'full'
+        return resolved
+    
+    def estimate_match_rate(self, threshold: int = 80, sample_size: int = 1000,
+                            stratify_by: Optional[str] = None, strata: int = 10,
+                            confidence: float = 0.95, bins: int = 10,
+                            random_state: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Estimate the match rate and score distribution from a sample of df1.
+        
+        A stratified random sample of df1 rows is matched against the full
+        df2 primary key index, which takes seconds instead of a full run.
+        
+        Args:
+            threshold: Minimum similarity score for matching (0-100)
+            sample_size: Number of df1 rows to sample (at least 1)
+            stratify_by: Optional df1 column whose values define the strata.
+                By default df1 is split into equal blocks of rows by position.
+                When there are more values than sample_size, the smallest
+                strata are merged into one.
+            strata: Number of position blocks when stratify_by is not given
+            confidence: Confidence level of the match rate interval
+            bins: Number of bins for the best score histogram over 0-100
+            random_state: Seed for reproducible samples
+            
+        Returns:
+            Dict with the estimated match rate, its confidence interval, the
+            per-stratum sample counts and a best score histogram DataFrame
+        """
+        started = time.perf_counter()
+        rng = np.random.default_rng(random_state)
+        
+        primary_key_source = str(self.mapping_df.iloc[0]['source_column'])
+        primary_key_target = str(self.mapping_df.iloc[0]['target_column'])
+        pk_source_cols = self.parse_mapping_expression(primary_key_source)
+        pk_target_cols = self.parse_mapping_expression(primary_key_target)
+        
+        # An empty sample says nothing about the match rate
+        population = len(self.df1)
+        if sample_size < 1:
+            raise ValueError("sample_size must be at least 1")
+        if population == 0:
+            raise ValueError("Cannot estimate the match rate of an empty df1")
+        
+        # Group df1 positions into at most sample_size strata
+        sample_size = min(sample_size, population)
+        if stratify_by is not None:
+            labels = self.df1[stratify_by].astype(object).where(self.df1[stratify_by].notna(), '<empty>')
+            groups = [np.flatnonzero((labels == value).to_numpy()) for value in labels.unique()]
+            if len(groups) > sample_size:
+                groups.sort(key=len, reverse=True)
+                keep = sample_size - 1
+                groups = groups[:keep] + [np.sort(np.concatenate(groups[keep:]))]
+        else:
+            n_blocks = min(strata, population, sample_size)
+            groups = [g for g in np.array_split(np.arange(population), n_blocks) if len(g)]
+        
+        # Proportional allocation with at least one row per stratum
+        allocation = allocate_sample([len(g) for g in groups], sample_size)
+        
+        keys2 = self._reference_keys(pk_target_cols)
+        self.metrics.start_run(sum(allocation), threshold)
+        
+        best_scores = []
+        stratum_rows = []
+        for group, n_sample in zip(groups, allocation):
+            matches = 0
+            for pos in rng.choice(group, size=n_sample, replace=False):
+                idx1 = self.df1.index[pos]
+                pk_value1 = self.get_concatenated_value(self.df1, pk_source_cols, idx1)
+                # Threshold 0 finds the best score even for rows that do not match
+                best_match_idx, best_match_score = self._find_best_match(pk_value1, keys2, 0)
+                matched = best_match_idx is not None and best_match_score >= threshold
+                matches += matched
+                best_scores.append(best_match_score)
+                self.metrics.row_done(matched, show_progress=False)
+            stratum_rows.append({'population': len(group), 'sample': n_sample, 'matches': matches})
+        
+        # Stratified estimate of the match rate with a Wilson score interval
+        # over the effective sample size
+        rate = 0.0
+        variance = 0.0
+        for row in stratum_rows:
+            if not row['sample']:
+                continue
+            weight = row['population'] / population
+            p_h = row['matches'] / row['sample']
+            rate += weight * p_h
+            if row['sample'] > 1:
+                fpc = 1 - row['sample'] / row['population']
+                variance += weight ** 2 * fpc * p_h * (1 - p_h) / (row['sample'] - 1)
+        
+        # The weights can sum to slightly more than 1 in floating point
+        rate = min(1.0, max(0.0, rate))
+        n_total = sum(allocation)
+        n_eff = rate * (1 - rate) / variance if variance > 0 else n_total
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        if n_total == population:
+            # Every row was sampled, so the rate is exact
+            center, margin = rate, 0.0
+        elif n_eff > 0:
+            center = (rate + z ** 2 / (2 * n_eff)) / (1 + z ** 2 / n_eff)
+            margin = z * math.sqrt(rate * (1 - rate) / n_eff + z ** 2 / (4 * n_eff ** 2)) / (1 + z ** 2 / n_eff)
+        else:
+            center, margin = rate, 0.0
+        
+        counts, edges = np.histogram(best_scores, bins=bins, range=(0, 100))
+        histogram = pd.DataFrame({
+            'score_from': edges[:-1].round(1),
+            'score_to': edges[1:].round(1),
+            'rows': counts,
+            'share': counts / len(best_scores) if best_scores else counts * 0.0,
+        })
+        
+        self.metrics.finish(show_progress=False)
+        self.metrics.diagnostics.flush()
+        estimate = {
+            'threshold': threshold,
+            'population': population,
+            'sample_size': n_total,
+            'sampled_matches': sum(row['matches'] for row in stratum_rows),
+            'estimated_match_rate': rate,
+            'confidence': confidence,
+            'ci_low': max(0.0, center - margin),
+            'ci_high': min(1.0, center + margin),
+            'strata': stratum_rows,
+            'score_histogram': histogram,
+            'seconds': time.perf_counter() - started,
+        }
+        print(f"Estimated match rate at threshold {threshold}: {rate*100:.2f}% "
+              f"({confidence*100:.0f}% CI {estimate['ci_low']*100:.2f}%-{estimate['ci_high']*100:.2f}%) "
+              f"from {n_total:,} of {population:,} rows")
+        return estimate
+    
+    def match_records(self, records: List[Dict[str, Any]], threshold: int = 80,
+                      candidate_sources: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Match ad-hoc df1-style records against df2 without a full run.
+        
+        Args:
+            records: Records keyed by df1 column names
+            threshold: Minimum similarity score for matching (0-100)
+            candidate_sources: Optional candidate indexes to narrow the df2 rows
+                scored per record (see process_mappings). The index is cached
+                with the df2 keys, so it is built once per reference.
+            
+        Returns:
+            One dict per record with 'record' (its position), 'matched' and, for
+            matched records, the same fields as a process_mappings result row
+        """
+        if candidate_sources and self.reference_store is not None:
+            raise ValueError("candidate_sources need the df2 keys in memory and cannot be "
+                             "combined with a reference store")
+        df1 = pd.DataFrame.from_records(records) if records else pd.DataFrame(index=pd.RangeIndex(0))
+        df1.columns = df1.columns.astype(str)
+        
+        primary_key_source = str(self.mapping_df.iloc[0]['source_column'])
+        primary_key_target = str(self.mapping_df.iloc[0]['target_column'])
+        pk_source_cols = self.parse_mapping_expression(primary_key_source)
+        pk_target_cols = self.parse_mapping_expression(primary_key_target)
+        
+        keys2 = self._reference_keys(pk_target_cols, candidate_sources)
+        plan = self._compile_mapping_plan()
+        field_cols = [(field, self.parse_mapping_expression(field)) for field in getattr(keys2, 'fields', [])]
+        results = ResultAccumulator(plan)
+        
+        for idx1 in df1.index:
+            pk_value1 = self.get_concatenated_value(df1, pk_source_cols, idx1)
+            fields1 = {field: self.get_concatenated_value(df1, cols, idx1)
+                       for field, cols in field_cols} if field_cols else None
+            best_match_idx, best_match_score = self._find_best_match(pk_value1, keys2, threshold,
+                                                                     fields1=fields1)
+            if best_match_idx is not None:
+                self._compare_mappings(plan, results, idx1, best_match_idx, best_match_score,
+                                       pk_value1, threshold, df1=df1)
+        
+        matches = [{'record': pos, 'matched': False} for pos in range(len(df1))]
+        for row in json.loads(results.to_frame().to_json(orient='records')):
+            matches[row['df1_row_index']].update(row, matched=True)
+        return matches
+    
+    def _materialize_keys(self, df: pd.DataFrame, columns: List[str]) -> Tuple[List[Any], List[str], List[int]]:
+        """
+        Build the lowercased key value of every row once.
+        
+        Args:
+            df: DataFrame to get values from
+            columns: List of key column names
+            
+        Returns:
+            Tuple of (row index labels, lowercased key values, key lengths)
+        """
+        labels = list(df.index)
+        values = [self.get_concatenated_value(df, columns, idx).lower() for idx in labels]
+        lengths = [len(value) for value in values]
+        return labels, values, lengths
+    
+    def _compile_mapping_plan(self) -> List[Tuple[str, str, List[str], List[str]]]:
+        """
+        Parse every mapping except the primary key once.
+        
+        Returns:
+            List of (source_expr, target_expr, source_cols, target_cols)
+        """
+        plan = []
+        for mapping_idx, mapping_row in self.mapping_df.iterrows():
+            if mapping_idx == 0:  # Skip primary key mapping
+                continue
+            
+            source_expr = str(mapping_row['source_column'])
+            target_expr = str(mapping_row['target_column'])
+            plan.append((source_expr, target_expr,
+                         self.parse_mapping_expression(source_expr),
+                         self.parse_mapping_expression(target_expr)))
+        return plan
+    
+    def _compile_cascade(self) -> Dict[str, Any]:
+        """
+        Build the cascade pairing plan from the mapping file.
+        
+        The optional 'comparator' column names a comparator from
+        FILTER_COMPARATORS or FUZZY_COMPARATORS for each mapping and the
+        optional 'weight' column its weight in the composite score (default 1).
+        Mappings without a comparator do not take part in pairing, except the
+        primary key, which defaults to 'fuzzy'. The df2 side of every
+        comparator is materialized once: a hash index of normalized values for
+        filters and the lowercased values for fuzzy comparators.
+        
+        Returns:
+            Dict with the df2 'labels', the 'filters' as (normalizer, source_cols,
+            index, weight) and the 'fuzzy' comparators as (scorer, source_cols,
+            values2, weight, is_ratio, is_primary_key) in cost order, and which
+            filter is the primary key ('pk_filter', or None)
+        """
+        labels = list(self.df2.index)
+        filters = []
+        fuzzy = []
+        pk_filter = None
+        for mapping_idx, mapping_row in self.mapping_df.iterrows():
+            comparator = mapping_row.get('comparator')
+            comparator = str(comparator).strip().lower() if pd.notna(comparator) and str(comparator).strip() else None
+            if comparator is None:
+                if mapping_idx != 0:
+                    continue
+                comparator = 'fuzzy'
+            weight = mapping_row.get('weight')
+            weight = float(weight) if pd.notna(weight) else 1.0
+            
+            source_cols = self.parse_mapping_expression(str(mapping_row['source_column']))
+            target_cols = self.parse_mapping_expression(str(mapping_row['target_column']))
+            values2 = self._materialize_keys(self.df2, target_cols)[1]
+            if comparator in FILTER_COMPARATORS:
+                normalizer = FILTER_COMPARATORS[comparator]
+                index = {}
+                for pos, value in enumerate(values2):
+                    index.setdefault(normalizer(value), []).append(pos)
+                if mapping_idx == 0:
+                    pk_filter = len(filters)
+                filters.append((normalizer, source_cols, index, weight))
+            elif comparator in FUZZY_COMPARATORS:
+                cost, scorer = FUZZY_COMPARATORS[comparator]
+                fuzzy.append((cost, (scorer, source_cols, values2, weight,
+                                     comparator == 'fuzzy', mapping_idx == 0)))
+            else:
+                raise ValueError(f"Unknown comparator '{comparator}' for mapping "
+                                 f"{mapping_row['source_column']} -> {mapping_row['target_column']}")
+        
+        fuzzy.sort(key=lambda item: item[0])
+        return {'labels': labels, 'filters': filters, 'fuzzy': [entry for _, entry in fuzzy],
+                'pk_filter': pk_filter}
+    
+    def _find_best_match_cascade(self, idx1, cascade: Dict[str, Any], threshold: int) -> Tuple[Any, int, float]:
+        """
+        Pick the df2 row for a df1 row with the cascade pairing plan.
+        
+        Filters keep only the df2 rows whose normalized value equals the df1
+        row's (filters with an empty df1 value are skipped). Fuzzy comparators
+        then run cheapest first; a candidate is dropped as soon as one scores
+        below threshold or its composite can no longer beat the best so far.
+        
+        Args:
+            idx1: Index label of the df1 row
+            cascade: Plan from _compile_cascade
+            threshold: Minimum similarity score for every fuzzy comparator (0-100)
+            
+        Returns:
+            Tuple of (df2 index label or None, primary key score, composite score)
         """
-        Initialize the mapper with paths to three Excel files.
+        positions = None
+        total_weight = 0.0
+        pk_filtered = False
+        for filter_pos, (normalizer, source_cols, index, weight) in enumerate(cascade['filters']):
+            value1 = normalizer(self.get_concatenated_value(self.df1, source_cols, idx1))
+            if not value1:
+                continue
+            total_weight += weight
+            pk_filtered = pk_filtered or filter_pos == cascade['pk_filter']
+            matching = index.get(value1, ())
+            positions = set(matching) if positions is None else positions.intersection(matching)
+            if not positions:
+                self.metrics.comparisons_pruned += len(cascade['labels'])
+                return None, 0, 0.0
+        filter_score = total_weight * 100
+        
+        fuzzy = [(scorer, self.get_concatenated_value(self.df1, source_cols, idx1).lower(),
+                  values2, weight, is_ratio, is_pk)
+                 for scorer, source_cols, values2, weight, is_ratio, is_pk in cascade['fuzzy']]
+        total_weight += sum(weight for _, _, _, weight, _, _ in fuzzy)
+        if total_weight == 0:
+            return None, 0, 0.0
+        # Score still reachable after each fuzzy comparator if the rest scored 100
+        remaining = [sum(entry[3] for entry in fuzzy[i + 1:]) * 100 for i in range(len(fuzzy))]
+        
+        n_rows = len(cascade['labels'])
+        candidates = sorted(positions) if positions is not None else range(n_rows)
+        pruned = n_rows - len(candidates)
+        compared = 0
+        best_pos = None
+        best_total = -1.0
+        best_pk_score = 0
+        for pos in candidates:
+            total = filter_score
+            pk_score = 100 if pk_filtered else 0
+            for step, (scorer, value1, values2, weight, is_ratio, is_pk) in enumerate(fuzzy):
+                value2 = values2[pos]
+                if is_ratio:
+                    # Same length bound as _find_best_match
+                    length = len(value1) + len(value2)
+                    if length and 200 * min(len(value1), len(value2)) / length + 0.5 < threshold:
+                        total = None
+                        break
+                compared += 1
+                score = scorer(value1, value2)
+                if score < threshold:
+                    total = None
+                    break
+                total += weight * score
+                if is_pk:
+                    pk_score = score
+                if total + remaining[step] <= best_total:
+                    total = None
+                    break
+            if total is None:
+                pruned += 1
+                continue
+            if total > best_total:
+                best_pos, best_total, best_pk_score = pos, total, pk_score
+        
+        self.metrics.comparisons += compared
+        self.metrics.comparisons_pruned += pruned
+        if best_pos is None:
+            return None, 0, 0.0
+        return cascade['labels'][best_pos], best_pk_score, round(best_total / total_weight, 2)
+    
+    def _find_best_match(self, pk_value1: str, keys2: Any, threshold: int,
+                         score_floor: Optional[int] = None,
+                         scored_pairs: Optional[List[Tuple[Any, int]]] = None,
+                         fields1: Optional[Dict[str, str]] = None) -> Tuple[Any, int]:
+        """
+        Find the df2 row whose primary key best matches a df1 primary key value.
         
         Args:
-            excel1_path: Path to first Excel file (with a1, a2, a3... columns)
-            excel2_path: Path to second Excel file (with b1, b2, b3... columns)
-            mapping_excel_path: Path to mapping Excel file
+            pk_value1: Primary key value from df1
+            keys2: Materialized df2 keys from _reference_keys
+            threshold: Minimum similarity score for matching (0-100)
+            score_floor: Lowest score to collect in scored_pairs
+            scored_pairs: Optional list that receives (df2 index label, score) for
+                every candidate scoring at least score_floor; such candidates
+                are never pruned
+            fields1: df1 row values of the mapping fields used by CandidateKeys sources
+            
+        Returns:
+            Tuple of (df2 index label or None, similarity score)
         """
-        self.excel1_path = excel1_path
-        self.excel2_path = excel2_path
-        self.mapping_excel_path = mapping_excel_path
+        value1 = pk_value1.lower()
+        len1 = len(value1)
+        best_match_idx = None
+        best_match_score = 0
+        compared = 0
+        pruned = 0
+        prune_cap = score_floor if scored_pairs is not None else 101
         
-        # Load the Excel files
-        self.df1 = pd.read_excel(excel1_path)
-        self.df2 = pd.read_excel(excel2_path)
-        self.mapping_df = pd.read_excel(mapping_excel_path)
+        if isinstance(keys2, ReferenceStore):
+            candidates = keys2.candidates(len1, min(threshold, prune_cap))
+        elif isinstance(keys2, CandidateKeys):
+            candidates = keys2.candidates(value1, min(threshold, prune_cap), fields1)
+            pruned += len(keys2) - len(candidates)
+        else:
+            candidates = zip(*keys2)
         
-        # Ensure column names are strings
-        self.df1.columns = self.df1.columns.astype(str)
-        self.df2.columns = self.df2.columns.astype(str)
+        for idx2, value2, len2 in candidates:
+            # fuzz.ratio can never exceed 200 * min(len1, len2) / (len1 + len2), so skip
+            # pairs that cannot reach the threshold or beat the current best score
+            total = len1 + len2
+            if total and 200 * min(len1, len2) / total + 0.5 < min(max(threshold, best_match_score + 1), prune_cap):
+                pruned += 1
+                continue
+            
+            compared += 1
+            score = fuzz.ratio(value1, value2)
+            if scored_pairs is not None and score >= score_floor:
+                scored_pairs.append((idx2, score))
+            if score >= threshold and score > best_match_score:
+                best_match_idx = idx2
+                best_match_score = score
+        
+        self.metrics.comparisons += compared
+        self.metrics.comparisons_pruned += pruned
+        return best_match_idx, best_match_score
     
-    def parse_mapping_expression(self, expr: str) -> List[str]:
+    def _find_best_match_bidirectional(self, pk_value1: str, idx1, keys2: Any, threshold: int,
+                                       reverse_best: Dict[Any, Tuple[int, Any]],
+                                       reverse_updates: Dict[Any, Tuple[int, Any]],
+                                       fields1: Optional[Dict[str, str]] = None) -> Tuple[Any, int]:
         """
-        Parse mapping expressions like 'a10+a12' into ['a10', 'a12']
+        Find the best df2 row for a df1 row while keeping every df2 row's best
+        df1 row up to date in the same pass.
+        
+        A pair is only pruned when its score bound can beat neither the df1
+        row's best so far nor the df2 row's best so far.
         
         Args:
-            expr: Expression string (e.g., 'a10+a12' or 'a1')
+            pk_value1: Primary key value from df1
+            idx1: Index label of the df1 row
+            keys2: Materialized df2 keys from _reference_keys
+            threshold: Minimum similarity score for matching (0-100)
+            reverse_best: df2 index label -> (score, df1 index label) of its best match
+            reverse_updates: Receives the reverse_best entries changed by this row
+            fields1: df1 row values of the mapping fields used by CandidateKeys sources
             
         Returns:
-            List of column names
+            Tuple of (df2 index label or None, similarity score)
         """
-        # Remove spaces and split by '+'
-        columns = expr.strip().replace(' ', '').split('+')
-        return columns
+        value1 = pk_value1.lower()
+        len1 = len(value1)
+        best_match_idx = None
+        best_match_score = 0
+        compared = 0
+        pruned = 0
+        
+        if isinstance(keys2, ReferenceStore):
+            candidates = keys2.candidates(len1, threshold)
+        elif isinstance(keys2, CandidateKeys):
+            candidates = keys2.candidates(value1, threshold, fields1)
+            pruned += len(keys2) - len(candidates)
+        else:
+            candidates = zip(*keys2)
+        
+        for idx2, value2, len2 in candidates:
+            reverse_score = reverse_best[idx2][0] if idx2 in reverse_best else 0
+            total = len1 + len2
+            if total and 200 * min(len1, len2) / total + 0.5 < max(threshold, min(best_match_score, reverse_score) + 1):
+                pruned += 1
+                continue
+            
+            compared += 1
+            score = fuzz.ratio(value1, value2)
+            if score < threshold:
+                continue
+            if score > best_match_score:
+                best_match_idx = idx2
+                best_match_score = score
+            if score > reverse_score:
+                reverse_best[idx2] = reverse_updates[idx2] = (score, idx1)
+        
+        self.metrics.comparisons += compared
+        self.metrics.comparisons_pruned += pruned
+        return best_match_idx, best_match_score
     
-    def get_concatenated_value(self, df: pd.DataFrame, columns: List[str], row_idx: int) -> str:
+    def _add_mutual_best_columns(self, results_df: pd.DataFrame, reverse_best: Dict[Any, Tuple[int, Any]]):
         """
-        Get concatenated value from multiple columns for a specific row.
+        Add each matched df2 row's own best df1 row and a mutual-best flag.
         
         Args:
-            df: DataFrame to get values from
-            columns: List of column names
-            row_idx: Row index
+            results_df: Results from process_mappings, changed in place
+            reverse_best: df2 index label -> (score, df1 index label) of its best match
+        """
+        reverse = [reverse_best[idx2] for idx2 in results_df['df2_row_index']]
+        position = results_df.columns.get_loc('primary_key_value') + 1
+        results_df.insert(position, 'df2_best_df1_row_index', [idx1 for _, idx1 in reverse])
+        results_df.insert(position + 1, 'df2_best_score', np.array([score for score, _ in reverse], dtype=np.int16))
+        results_df.insert(position + 2, 'mutual_best',
+                          results_df['df2_best_df1_row_index'].to_numpy() == results_df['df1_row_index'].to_numpy())
+    
+    def _score_pairs(self, plan: List[Tuple[str, str, List[str], List[str]]],
+                     scored_pairs: List[Tuple[Any, Any, int]]) -> Dict[str, np.ndarray]:
+        """
+        Score every mapping for a list of candidate pairs.
+        
+        Args:
+            plan: Mapping plan from _compile_mapping_plan
+            scored_pairs: (df1 index label, df2 index label, primary key score) per pair
             
         Returns:
-            Concatenated string value
+            Arrays for ScoreStore.write_part
         """
-        values = []
-        for col in columns:
-            if col in df.columns:
-                val = df.loc[row_idx, col]
-                if pd.notna(val):
-                    values.append(str(val))
-            else:
-                print(f"Warning: Column '{col}' not found in DataFrame")
-                break
+        mapping_scores = np.zeros((len(scored_pairs), len(plan)), dtype=np.uint8)
+        for row, (idx1, idx2, _) in enumerate(scored_pairs):
+            values2 = self.reference_store.fetch(idx2) if self.reference_store is not None else None
+            for col, (_, target_expr, source_cols, target_cols) in enumerate(plan):
+                value1 = self.get_concatenated_value(self.df1, source_cols, idx1)
+                if values2 is not None:
+                    value2 = values2[target_expr]
+                else:
+                    value2 = self.get_concatenated_value(self.df2, target_cols, idx2)
+                mapping_scores[row, col] = self.fuzzy_match_rows(value1, value2)[1]
         
-        return ' '.join(values)
+        return {
+            'df1_row': np.array([pair[0] for pair in scored_pairs], dtype=np.int64),
+            'df2_row': np.array([pair[1] for pair in scored_pairs], dtype=np.int64),
+            'pk_score': np.array([pair[2] for pair in scored_pairs], dtype=np.uint8),
+            'mapping_scores': mapping_scores,
+        }
     
-    def fuzzy_match_rows(self, str1: str, str2: str, threshold: int = 80) -> Tuple[bool, int]:
+    def reanalyze(self, score_store_path: str, threshold: Optional[int] = None,
+                  tie_break: str = 'first', bidirectional: bool = False,
+                  output_profile: str = 'full') -> pd.DataFrame:
         """
-        Perform case-insensitive fuzzy matching between two strings.
+        Rebuild process_mappings results from a saved score store without
+        rescoring, for example with a different threshold or tie-breaking.
         
         Args:
-            str1: First string
-            str2: Second string
-            threshold: Minimum similarity score (0-100)
+            score_store_path: Directory written by process_mappings(score_store_path=...)
+            threshold: Minimum similarity score (default: the saved run's threshold).
+                Must not be below the saved score floor.
+            tie_break: How to pick between equal primary key scores: 'first'
+                (the first df2 row, as process_mappings does), 'last', or
+                'mappings' (the highest total mapping score, then first)
+            bidirectional: Add mutual-best columns as process_mappings does
+            output_profile: Result columns to keep, as in process_mappings. The
+                mapping scores are stored, so 'scores' and 'refs' skip reading
+                the compared values altogether.
             
         Returns:
-            Tuple of (is_match, similarity_score)
+            DataFrame with fuzzy matching results, ready for generate_match_report
         """
-        # Convert to string, handle None values, and convert to lowercase
-        str1 = str(str1).lower() if pd.notna(str1) else ''
-        str2 = str(str2).lower() if pd.notna(str2) else ''
+        if tie_break not in ('first', 'last', 'mappings'):
+            raise ValueError(f"Unknown tie_break: {tie_break}")
+        if output_profile not in OUTPUT_PROFILES:
+            raise ValueError(f"Unknown output profile: {output_profile}")
         
-        # Calculate similarity score on lowercase strings
-        score = fuzz.ratio(str1, str2)
+        meta, arrays = ScoreStore(score_store_path).load()
+        threshold = meta['threshold'] if threshold is None else threshold
+        if threshold < meta['score_floor']:
+            raise ValueError(f"threshold {threshold} is below the saved score floor {meta['score_floor']}")
+        if meta['inputs'] != self._inputs_digest():
+            raise ValueError(f"Score store {score_store_path} was written for different inputs or mapping")
         
-        return score >= threshold, score
+        plan = self._compile_mapping_plan()
+        pk_source_cols = self.parse_mapping_expression(str(self.mapping_df.iloc[0]['source_column']))
+        mapping_scores = arrays['mapping_scores']
+        
+        pairs = pd.DataFrame({
+            'df1_row': arrays['df1_row'],
+            'df2_row': arrays['df2_row'],
+            'pk_score': arrays['pk_score'],
+            'mapping_total': mapping_scores.sum(axis=1, dtype=np.int64),
+            'order': np.arange(len(arrays['pk_score'])),
+        })
+        pairs = pairs[pairs['pk_score'] >= threshold]
+        
+        # Pairs were saved in scan order, so 'order' reproduces the original tie-breaking
+        sort_by = {'first': (['pk_score', 'order'], [False, True]),
+                   'last': (['pk_score', 'order'], [False, False]),
+                   'mappings': (['pk_score', 'mapping_total', 'order'], [False, False, True])}[tie_break]
+        chosen = (pairs.sort_values(sort_by[0], ascending=sort_by[1], kind='stable')
+                  .drop_duplicates('df1_row').sort_values('order'))
+        
+        include_values = output_profile == 'full'
+        results = ResultAccumulator(plan, include_values)
+        for idx1, idx2, pk_score, order in zip(chosen['df1_row'], chosen['df2_row'],
+                                               chosen['pk_score'], chosen['order']):
+            values2 = (self.reference_store.fetch(idx2)
+                       if self.reference_store is not None and include_values else None)
+            outputs = []
+            for col, (_, target_expr, source_cols, target_cols) in enumerate(plan):
+                score = int(mapping_scores[order, col])
+                if not include_values:
+                    outputs.append((score, score >= threshold, None, None))
+                    continue
+                value1 = self.get_concatenated_value(self.df1, source_cols, idx1)
+                if values2 is not None:
+                    value2 = values2[target_expr]
+                else:
+                    value2 = self.get_concatenated_value(self.df2, target_cols, idx2)
+                outputs.append((score, score >= threshold, value1, value2))
+            pk_value1 = self.get_concatenated_value(self.df1, pk_source_cols, idx1)
+            results.add(int(idx1), int(idx2), int(pk_score), pk_value1, outputs)
+        
+        results_df = results.to_frame()
+        results_df.attrs['output_profile'] = output_profile
+        if bidirectional:
+            reverse = (pairs.sort_values(['pk_score', 'order'], ascending=[False, True], kind='stable')
+                       .drop_duplicates('df2_row'))
+            reverse_best = {idx2: (int(score), int(idx1)) for idx2, score, idx1
+                            in zip(reverse['df2_row'], reverse['pk_score'], reverse['df1_row'])}
+            self._add_mutual_best_columns(results_df, reverse_best)
+        return results_df
     
-    def process_mappings(self, threshold: int = 80) -> pd.DataFrame:
+    def _compare_mappings(self, plan: List[Tuple[str, str, List[str], List[str]]],
+                          results: 'ResultAccumulator', idx1, idx2, pk_score: int,
+                          pk_value1: str, threshold: int, df1: Optional[pd.DataFrame] = None):
         """
-        Process all mappings and perform fuzzy matching.
+        Compare all non primary key mappings for a matched row pair and add
+        the row to the results.
         
         Args:
+            plan: Mapping plan from _compile_mapping_plan
+            results: Accumulator to add the row to
+            idx1: Index label of the df1 row
+            idx2: Index label of the matched df2 row
+            pk_score: Primary key similarity score
+            pk_value1: Primary key value from df1
             threshold: Minimum similarity score for matching (0-100)
+            df1: Frame the df1 row comes from (default: self.df1)
+        """
+        df1 = self.df1 if df1 is None else df1
+        values2 = self.reference_store.fetch(idx2) if self.reference_store is not None else None
+        outputs = []
+        for source_expr, target_expr, source_cols, target_cols in plan:
+            value1 = self.get_concatenated_value(df1, source_cols, idx1)
+            if values2 is not None:
+                value2 = values2[target_expr]
+            else:
+                value2 = self.get_concatenated_value(self.df2, target_cols, idx2)
             
-        Returns:
-            DataFrame with fuzzy matching results
+            is_match, score = self.fuzzy_match_rows(value1, value2, threshold)
+            outputs.append((score, is_match, value1, value2))
+        
+        results.add(idx1, idx2, pk_score, pk_value1, outputs)
+    
+    def _run_fingerprint(self, threshold: int, **options) -> str:
         """
-
-        print ("DFs :\n")
-        print (f"Excel1: {self.df1.head()}\n")
-        print (f"Excel2: {self.df2.head()}\n")
-              
-        results = []
+        Build a fingerprint of the inputs and config that a checkpoint belongs to.
         
-        # Get primary key mapping (assuming first row contains primary key mapping)
-        if len(self.mapping_df) > 0:
-            primary_key_source = str(self.mapping_df.iloc[0]['source_column'])
-            primary_key_target = str(self.mapping_df.iloc[0]['target_column'])
+        Args:
+            threshold: Minimum similarity score used for the run
+            **options: Other run options that change the results
             
-            # Parse primary key columns
-            pk_source_cols = self.parse_mapping_expression(primary_key_source)
-            pk_target_cols = self.parse_mapping_expression(primary_key_target)
+        Returns:
+            Hex digest identifying the run
+        """
+        h = hashlib.sha256(self._inputs_digest().encode())
+        h.update(f"{threshold}\n".encode())
+        h.update(json.dumps(options, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+    
+    def _inputs_digest(self) -> str:
+        """
+        Build a fingerprint of the input files and mapping configuration.
+        
+        Returns:
+            Hex digest identifying the inputs
+        """
+        h = hashlib.sha256()
+        for path in (self.excel1_path, self.excel2_path, self.mapping_excel_path):
+            stat = os.stat(path)
+            h.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+        h.update(f"{len(self.df1)}|{self.reference_rows()}|{self.sheet_name}\n".encode())
+        h.update(self.mapping_df.to_csv(index=False).encode())
+        return h.hexdigest()
+    
+    def _load_checkpoint(self, checkpoint_path: str, fingerprint: str, results: 'ResultAccumulator',
+                         state: Dict[str, Dict]) -> Tuple[int, int]:
+        """
+        Load completed row ranges from a checkpoint file.
+        
+        The file holds a header record followed by one record per completed
+        range. A record cut short by a crash is ignored, as is a checkpoint
+        written for different inputs or config. The caller truncates the file
+        to the returned offset before appending to it.
+        
+        Args:
+            checkpoint_path: Path to the checkpoint file
+            fingerprint: Fingerprint of the current run
+            results: Accumulator to add the checkpointed results to
+            state: Dicts of run state (such as reverse best matches) to update
+                with the checkpointed changes
             
-            print(f"Primary key mapping: {primary_key_source} -> {primary_key_target}")
+        Returns:
+            Tuple of (next df1 position to process, file offset after the
+            last good range record)
+        """
+        next_pos = 0
+        if not os.path.exists(checkpoint_path):
+            return next_pos, 0
+        
+        with open(checkpoint_path, 'rb') as f:
+            try:
+                header = pickle.load(f)
+            except Exception:
+                return next_pos, 0
+            if header.get('fingerprint') != fingerprint:
+                self.metrics.diagnostics.warning(('stale_checkpoint', checkpoint_path),
+                                                 "Ignoring checkpoint %s: written for different inputs or config",
+                                                 checkpoint_path)
+                return next_pos, 0
             
-            # Process each row in df1
-            for idx1, row1 in self.df1.iterrows():
-                # Get primary key value from df1
-                pk_value1 = self.get_concatenated_value(self.df1, pk_source_cols, idx1)
-                
-                # Find matching row in df2 based on primary key
-                best_match_idx = None
-                best_match_score = 0
-                
-                for idx2, row2 in self.df2.iterrows():
-                    pk_value2 = self.get_concatenated_value(self.df2, pk_target_cols, idx2)
-                    # The fuzzy_match_rows function now handles case-insensitivity internally
-                    is_match, score = self.fuzzy_match_rows(pk_value1, pk_value2, threshold)
-                    
-                    if is_match and score > best_match_score:
-                        best_match_idx = idx2
-                        best_match_score = score
-                
-                if best_match_idx is not None:
-                    # Process all other column mappings for this row pair
-                    row_result = {
-                        'df1_row_index': idx1,
-                        'df2_row_index': best_match_idx,
-                        'primary_key_score': best_match_score,
-                        'primary_key_value': pk_value1
-                    }
-                    
-                    # Check all other mappings
-                    for mapping_idx, mapping_row in self.mapping_df.iterrows():
-                        if mapping_idx == 0:  # Skip primary key mapping
-                            continue
-                        
-                        source_expr = str(mapping_row['source_column'])
-                        target_expr = str(mapping_row['target_column'])
-                        
-                        source_cols = self.parse_mapping_expression(source_expr)
-                        target_cols = self.parse_mapping_expression(target_expr)
-                        
-                        value1 = self.get_concatenated_value(self.df1, source_cols, idx1)
-                        value2 = self.get_concatenated_value(self.df2, target_cols, best_match_idx)
-                        
-                        is_match, score = self.fuzzy_match_rows(value1, value2, threshold)
-                        
-                        row_result[f'mapping_{source_expr}_to_{target_expr}_score'] = score
-                        row_result[f'mapping_{source_expr}_to_{target_expr}_match'] = is_match
-                        row_result[f'value1_{source_expr}'] = value1
-                        row_result[f'value2_{target_expr}'] = value2
-                    
-                    results.append(row_result)
+            good_end = f.tell()
+            while True:
+                try:
+                    range_start, range_end, range_results, range_state = pickle.load(f)
+                except Exception:
+                    break
+                if range_start != next_pos:
+                    break
+                results.extend(range_results)
+                for key, changes in range_state.items():
+                    state.setdefault(key, {}).update(changes)
+                next_pos = range_end
+                good_end = f.tell()
+        
+        return next_pos, good_end
+    
+    def _append_checkpoint(self, checkpoint_path: str, fingerprint: str, range_start: int,
+                           range_end: int, range_results: 'ResultAccumulator',
+                           range_state: Optional[Dict[str, Dict]] = None):
+        """
+        Append one completed df1 row range and its results to the checkpoint file.
+        
+        Args:
+            checkpoint_path: Path to the checkpoint file
+            fingerprint: Fingerprint of the current run
+            range_start: First df1 position of the range
+            range_end: Position after the last df1 row of the range
+            range_results: Results for the rows in the range
+            range_state: Run state changes made while processing the range
+        """
+        # A new run (or one whose checkpoint was discarded) starts a fresh file
+        mode = 'ab' if range_start > 0 and os.path.exists(checkpoint_path) else 'wb'
+        with open(checkpoint_path, mode) as f:
+            if mode == 'wb':
+                pickle.dump({'fingerprint': fingerprint}, f)
+            pickle.dump((range_start, range_end, range_results, range_state or {}), f)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _summary_frame(self, results_df: pd.DataFrame, matched_rows: Optional[int] = None) -> pd.DataFrame:
+        """
+        Build the Summary sheet of the match report.
         
-        return pd.DataFrame(results)
+        Args:
+            results_df: DataFrame with matching results
+            matched_rows: Number of matched rows when results_df does not hold
+                them all (default: len(results_df))
+            
+        Returns:
+            One-row DataFrame of summary figures
+        """
+        if matched_rows is None:
+            matched_rows = len(results_df)
+        summary_data = {
+            'Total Rows in Excel1': [len(self.df1)],
+            'Total Rows in Excel2': [self.reference_rows()],
+            'Total Matched Rows': [matched_rows],
+            'Match Rate': [f"{matched_rows/len(self.df1)*100:.2f}%" if len(self.df1) > 0 else "0.00%"]
+        }
+        if 'mutual_best' in results_df.columns:
+            summary_data['Mutual Best Pairs'] = [int(results_df['mutual_best'].sum())]
+            summary_data['Conflicting Pairs'] = [int((~results_df['mutual_best']).sum())]
+        if self.metrics.total_rows:
+            summary_data.update({name: [value] for name, value in self.metrics.summary_columns().items()})
+        return pd.DataFrame(summary_data)
     
     def generate_match_report(self, results_df: pd.DataFrame, output_path: str = 'fuzzy_match_report.xlsx'):
         """
@@ -177,40 +2822,569 @@ class ExcelFuzzyMapper:
             results_df: DataFrame with matching results
             output_path: Path to save the report
         """
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+        with self.metrics.phase('report'), pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+            # Results kept as row references get their values only now
+            if results_df.attrs.get('output_profile') == 'refs':
+                results_df = self.resolve_values(results_df)
+            
             # Write main results
             results_df.to_excel(writer, sheet_name='Match Results', index=False)
             
             # Create summary sheet
-            summary_data = {
-                'Total Rows in Excel1': [len(self.df1)],
-                'Total Rows in Excel2': [len(self.df2)],
-                'Total Matched Rows': [len(results_df)],
-                'Match Rate': [f"{len(results_df)/len(self.df1)*100:.2f}%" if len(self.df1) > 0 else "0.00%"]
-            }
-            summary_df = pd.DataFrame(summary_data)
+            summary_df = self._summary_frame(results_df)
             summary_df.to_excel(writer, sheet_name='Summary', index=False)
             
             # Write mapping configuration
             self.mapping_df.to_excel(writer, sheet_name='Mapping Configuration', index=False)
         
+        # Rewrite the metrics file so it includes the report phase
+        if self.metrics_path:
+            self.metrics.write_json(self.metrics_path)
+        
+        print(f"Match report saved to: {output_path}")
+
+# Reference frames and key indexes kept warm inside a batch worker process
+_BATCH_REFERENCE_CACHE: Dict[Any, Any] = {}
+
+
+def read_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """
+    Read a batch manifest of reconciliation jobs.
+    
+    The manifest is a JSON list of objects or a CSV/Excel/Parquet table with
+    excel1, excel2, mapping and output columns, and an optional threshold
+    column. Relative paths are resolved against the manifest's directory.
+    
+    Args:
+        manifest_path: Path to the manifest
+        
+    Returns:
+        List of job dicts, each with a 'job' number in manifest order
+    """
+    if manifest_path.lower().endswith('.json'):
+        with open(manifest_path) as f:
+            entries = json.load(f)
+    else:
+        entries = read_table(manifest_path).to_dict('records')
+    
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for job_number, entry in enumerate(entries):
+        missing = [key for key in ('excel1', 'excel2', 'mapping', 'output') if key not in entry]
+        if missing:
+            raise ValueError(f"Manifest entry {job_number} is missing {', '.join(missing)}")
+        job = {'job': job_number}
+        for key in ('excel1', 'excel2', 'mapping', 'output'):
+            job[key] = os.path.join(base_dir, str(entry[key]))
+        threshold = entry.get('threshold')
+        job['threshold'] = None if threshold is None or pd.isna(threshold) else int(threshold)
+        jobs.append(job)
+    return jobs
+
+
+def _run_batch_chunk(jobs: List[Dict[str, Any]], threshold: int,
+                     mapper_kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Run jobs sharing one reference file in a batch worker process.
+    
+    Args:
+        jobs: Jobs from read_manifest with the same excel2 file
+        threshold: Threshold for jobs that do not set their own
+        mapper_kwargs: Extra keyword arguments for ExcelFuzzyMapper
+        
+    Returns:
+        One outcome dict per job
+    """
+    # Keep only one reference warm per worker so memory stays bounded
+    reference = os.path.abspath(jobs[0]['excel2'])
+    if _BATCH_REFERENCE_CACHE.get('reference') != reference:
+        _BATCH_REFERENCE_CACHE.clear()
+        _BATCH_REFERENCE_CACHE['reference'] = reference
+    
+    outcomes = []
+    for job in jobs:
+        started = time.perf_counter()
+        outcome = {'job': job['job'], 'excel1': job['excel1'], 'excel2': job['excel2'],
+                   'output': job['output'], 'status': 'ok', 'rows': None,
+                   'matched_rows': None, 'seconds': None, 'error': None}
+        try:
+            mapper = ExcelFuzzyMapper(job['excel1'], job['excel2'], job['mapping'],
+                                      reference_cache=_BATCH_REFERENCE_CACHE, **mapper_kwargs)
+            job_threshold = job['threshold'] if job['threshold'] is not None else threshold
+            results = mapper.process_mappings(job_threshold, show_progress=False)
+            mapper.generate_match_report(results, job['output'])
+            outcome['rows'] = len(mapper.df1)
+            outcome['matched_rows'] = len(results)
+        except Exception as e:
+            outcome['status'] = 'error'
+            outcome['error'] = f"{type(e).__name__}: {e}"
+        outcome['seconds'] = round(time.perf_counter() - started, 3)
+        outcomes.append(outcome)
+    return outcomes
+
+
+def run_batch(manifest_path: str, threshold: int = 80, max_workers: Optional[int] = None,
+              **mapper_kwargs) -> pd.DataFrame:
+    """
+    Run many reconciliation jobs from a manifest in one set of warm processes.
+    
+    Jobs are grouped by reference (excel2) file and the groups are split into
+    chunks spread across worker processes. Each worker keeps the loaded
+    reference frame and its primary key index warm across the jobs of a chunk.
+    
+    Args:
+        manifest_path: Path to the manifest (see read_manifest)
+        threshold: Minimum similarity score for jobs that do not set their own
+        max_workers: Number of worker processes (default: CPU count)
+        **mapper_kwargs: Extra keyword arguments for ExcelFuzzyMapper
+        
+    Returns:
+        DataFrame with one outcome row per job, in manifest order
+    """
+    jobs = read_manifest(manifest_path)
+    if not jobs:
+        return pd.DataFrame()
+    
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        groups.setdefault(os.path.abspath(job['excel2']), []).append(job)
+    
+    max_workers = max_workers or os.cpu_count() or 1
+    chunk_size = max(1, math.ceil(len(jobs) / max_workers))
+    chunks = [group[i:i + chunk_size] for group in groups.values() for i in range(0, len(group), chunk_size)]
+    
+    outcomes = []
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = [executor.submit(_run_batch_chunk, chunk, threshold, mapper_kwargs) for chunk in chunks]
+        for future in as_completed(futures):
+            for outcome in future.result():
+                if outcome['status'] == 'ok':
+                    print(f"Job {outcome['job']}: {outcome['matched_rows']}/{outcome['rows']} rows matched "
+                          f"in {outcome['seconds']:.1f}s -> {outcome['output']}")
+                else:
+                    print(f"Job {outcome['job']} failed: {outcome['error']}")
+                outcomes.append(outcome)
+    
+    return pd.DataFrame(outcomes).sort_values('job').reset_index(drop=True)
+
+
+def resolve_sheets(excel1_path: str, excel2_path: str,
+                   sheets: Union[None, str, int, List[Union[str, int]]]) -> List[Union[str, int]]:
+    """
+    Turn a sheet selection into the list of sheets to reconcile.
+    
+    Args:
+        excel1_path: Path to the first workbook
+        excel2_path: Path to the second workbook
+        sheets: None for the first sheet, a sheet name or position, a list of
+            them, or '*' for every sheet present in both workbooks
+        
+    Returns:
+        Sheet names or positions, in selection (or excel1 workbook) order
+    """
+    if sheets is None:
+        return [0]
+    if sheets == '*':
+        sheets2 = set(list_sheets(excel2_path))
+        common = [name for name in list_sheets(excel1_path) if name in sheets2]
+        if not common:
+            raise ValueError(f"{excel1_path} and {excel2_path} have no sheet names in common")
+        return common
+    if isinstance(sheets, (str, int)):
+        return [sheets]
+    
+    sheets1, sheets2 = list_sheets(excel1_path), list_sheets(excel2_path)
+    for sheet in sheets:
+        for path, names in ((excel1_path, sheets1), (excel2_path, sheets2)):
+            if isinstance(sheet, str) and sheet not in names:
+                raise ValueError(f"Sheet '{sheet}' not found in {path}")
+    return list(sheets)
+
+
+# File and directory options each sheet worker writes or rebuilds on its own
+SHEET_PATH_KWARGS = ('report_path', 'metrics_path', 'checkpoint_path', 'score_store_path', 'reference_store')
+
+
+def _sheet_path_kwargs(kwargs: Dict[str, Any], selected: List[Union[str, int]]) -> Dict[Union[str, int], Dict[str, Any]]:
+    """
+    Give every sheet its own copy of the path options in kwargs.
+    
+    Sheet workers run in parallel, so a shared report, metrics, checkpoint,
+    score store or reference store path would be overwritten by whichever
+    sheet finishes last. Each path gets the sheet name as a suffix before its
+    extension, e.g. report.xlsx becomes report_Sheet1.xlsx.
+    
+    Returns:
+        Dict of sheet -> kwargs for that sheet
+    """
+    suffixes = [re.sub(r'[^\w.-]+', '_', str(sheet)) for sheet in selected]
+    if len(set(suffixes)) < len(suffixes):
+        suffixes = [f"{i}_{suffix}" for i, suffix in enumerate(suffixes)]
+    
+    per_sheet = {}
+    for sheet, suffix in zip(selected, suffixes):
+        sheet_kwargs = dict(kwargs)
+        for key in SHEET_PATH_KWARGS:
+            if sheet_kwargs.get(key):
+                root, ext = os.path.splitext(os.fspath(sheet_kwargs[key]).rstrip('/\\'))
+                sheet_kwargs[key] = f"{root}_{suffix}{ext}"
+        per_sheet[sheet] = sheet_kwargs
+    return per_sheet
+
+
+def _run_sheet(excel1_path: str, excel2_path: str, mapping_excel_path: str, sheet: Union[str, int],
+               threshold: int, mapper_kwargs: Dict[str, Any], process_kwargs: Dict[str, Any],
+               resolve_refs: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Reconcile one sheet pair in a worker process.
+    
+    Returns:
+        Tuple of (results, one-row summary). Results of the 'refs' output
+        profile get their values here when resolve_refs is set, since only
+        this worker has the sheet loaded.
+    """
+    mapper = ExcelFuzzyMapper(excel1_path, excel2_path, mapping_excel_path, sheet_name=sheet, **mapper_kwargs)
+    results = mapper.process_mappings(threshold, show_progress=False, **process_kwargs)
+    if resolve_refs and results.attrs.get('output_profile') == 'refs':
+        results = mapper.resolve_values(results)
+    return results, mapper._summary_frame(results)
+
+
+def reconcile_sheets(excel1_path: str, excel2_path: str, mapping_excel_path: str,
+                     sheets: Union[None, str, int, List[Union[str, int]]] = '*', threshold: int = 80,
+                     output_path: Optional[str] = None, max_workers: Optional[int] = None,
+                     mapper_kwargs: Optional[Dict[str, Any]] = None,
+                     **process_kwargs) -> pd.DataFrame:
+    """
+    Reconcile matching sheets of two workbooks in parallel, one worker process per sheet pair.
+    
+    Every sheet pair uses the same mapping file, so all sheets produce the
+    same result columns and combine into one report.
+    
+    Args:
+        excel1_path: Path to the first workbook
+        excel2_path: Path to the second workbook
+        mapping_excel_path: Path to mapping Excel file
+        sheets: Sheet selection (see resolve_sheets); '*' reconciles every
+            sheet present in both workbooks
+        threshold: Minimum similarity score for matching (0-100)
+        output_path: Optional path of the combined xlsx report, with a sheet
+            column in Match Results and one Summary row per sheet plus a total
+        max_workers: Number of worker processes (default: CPU count)
+        mapper_kwargs: Extra keyword arguments for ExcelFuzzyMapper
+        **process_kwargs: Extra keyword arguments for process_mappings
+        
+        Paths among the extra keyword arguments (SHEET_PATH_KWARGS) get the
+        sheet name as a suffix, so every sheet writes its own files.
+        
+    Returns:
+        Combined results with a leading sheet column
+    """
+    selected = resolve_sheets(excel1_path, excel2_path, sheets)
+    sheet_mapper_kwargs = _sheet_path_kwargs(mapper_kwargs or {}, selected)
+    sheet_process_kwargs = _sheet_path_kwargs(process_kwargs, selected)
+    mapping_df = read_table(mapping_excel_path)
+    
+    outcomes = {}
+    max_workers = min(max_workers or os.cpu_count() or 1, len(selected))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_sheet, excel1_path, excel2_path, mapping_excel_path, sheet,
+                                   threshold, sheet_mapper_kwargs[sheet], sheet_process_kwargs[sheet],
+                                   output_path is not None): sheet
+                   for sheet in selected}
+        for future in as_completed(futures):
+            sheet = futures[future]
+            results, summary = future.result()
+            print(f"Sheet {sheet}: {len(results)}/{int(summary['Total Rows in Excel1'].iloc[0])} rows matched")
+            outcomes[sheet] = (results, summary)
+    
+    frames = []
+    summaries = []
+    for sheet in selected:
+        results, summary = outcomes[sheet]
+        frames.append(results.assign(sheet=str(sheet))[['sheet'] + list(results.columns)]
+                      if len(results.columns) else pd.DataFrame({'sheet': []}))
+        summaries.append(summary.assign(Sheet=str(sheet))[['Sheet'] + list(summary.columns)])
+    combined = pd.concat(frames, ignore_index=True)
+    summary_df = pd.concat(summaries, ignore_index=True)
+    
+    total_rows1 = int(summary_df['Total Rows in Excel1'].sum())
+    total = {
+        'Sheet': 'All sheets',
+        'Total Rows in Excel1': total_rows1,
+        'Total Rows in Excel2': int(summary_df['Total Rows in Excel2'].sum()),
+        'Total Matched Rows': len(combined),
+        'Match Rate': f"{len(combined)/total_rows1*100:.2f}%" if total_rows1 > 0 else "0.00%",
+    }
+    summary_df = pd.concat([summary_df, pd.DataFrame([total])], ignore_index=True)
+    
+    if output_path:
+        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+            combined.to_excel(writer, sheet_name='Match Results', index=False)
+            summary_df.to_excel(writer, sheet_name='Summary', index=False)
+            mapping_df.to_excel(writer, sheet_name='Mapping Configuration', index=False)
         print(f"Match report saved to: {output_path}")
+    
+    return combined
+
+
+class _MatchRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler for MatchService.
+    
+    GET /health reports the loaded reference. POST /match takes a JSON body
+    with either "record" (one object) or "records" (a list of objects) keyed
+    by df1 column names, and an optional "threshold".
+    """
+    
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        self._send_json(200, self.server.service.health())
+    
+    def do_POST(self):
+        if self.path != '/match':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("Request body must be a JSON object")
+            records = [request['record']] if 'record' in request else request.get('records', [])
+            if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                raise ValueError("'records' must be a list of objects")
+            threshold = request.get('threshold')
+            if threshold is not None:
+                try:
+                    if isinstance(threshold, bool):
+                        raise TypeError(threshold)
+                    threshold = int(threshold)
+                except (TypeError, ValueError):
+                    raise ValueError("'threshold' must be a number") from None
+                if not 0 <= threshold <= 100:
+                    raise ValueError("'threshold' must be between 0 and 100")
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        
+        service = self.server.service
+        if len(records) > service.max_batch:
+            self._send_json(413, {'error': f"At most {service.max_batch} records per request"})
+            return
+        try:
+            response = service.match(records, threshold)
+        except Exception as e:
+            # Covers a failed reference reload as well as matching errors
+            logger.exception("Match request failed")
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, response)
+    
+    def log_message(self, format, *args):
+        # Keep per-request logging off stdout/stderr
+        pass
+
+
+class MatchService:
+    """
+    Long-running local match service that keeps the reference index warm.
+    
+    excel2 and the mapping file are loaded and the primary key index is built
+    once. Single records or small batches are then matched in memory, and the
+    index is rebuilt when either file changes on disk. If a rebuild fails (for
+    example on a file that is still being written), the previous index keeps
+    serving, /health reports the error and the next request tries again.
+    """
+    
+    def __init__(self, excel2_path: str, mapping_excel_path: str, threshold: int = 80,
+                 max_batch: int = 1000, candidate_sources: Optional[List[str]] = None, **mapper_kwargs):
+        """
+        Load the reference file and build its index.
+        
+        Args:
+            excel2_path: Path to the reference file (with b1, b2, b3... columns)
+            mapping_excel_path: Path to mapping Excel file
+            threshold: Default minimum similarity score (0-100)
+            max_batch: Maximum number of records per request
+            candidate_sources: Optional candidate indexes (see process_mappings),
+                built with the reference so requests only score the candidates
+                instead of every reference row
+            **mapper_kwargs: Extra keyword arguments for ExcelFuzzyMapper
+        """
+        self.excel2_path = excel2_path
+        self.mapping_excel_path = mapping_excel_path
+        self.threshold = threshold
+        self.max_batch = max_batch
+        self.candidate_sources = candidate_sources
+        self.mapper_kwargs = mapper_kwargs
+        self.reload_error = None
+        self._load()
+    
+    def _file_identity(self) -> Tuple:
+        """
+        Identify the current versions of the reference and mapping files.
+        
+        Returns:
+            Tuple of (size, modification time) for both files
+        """
+        identity = ()
+        for path in (self.excel2_path, self.mapping_excel_path):
+            stat = os.stat(path)
+            identity += (stat.st_size, stat.st_mtime_ns)
+        return identity
+    
+    def _load(self):
+        """
+        Load the reference and mapping files and warm the primary key index.
+        """
+        started = time.perf_counter()
+        identity = self._file_identity()
+        mapper = ExcelFuzzyMapper(None, self.excel2_path, self.mapping_excel_path,
+                                  reference_cache={}, **self.mapper_kwargs)
+        mapper.match_records([], candidate_sources=self.candidate_sources)
+        # Only switch over once the new index is complete
+        self.mapper, self.identity = mapper, identity
+        self.reload_error = None
+        self.loaded_at = datetime.datetime.now().isoformat(timespec='seconds')
+        print(f"Reference loaded: {self.mapper.reference_rows():,} rows from {self.excel2_path} "
+              f"in {time.perf_counter() - started:.2f}s")
+    
+    def reload_if_changed(self) -> bool:
+        """
+        Rebuild the index if the reference or mapping file changed.
+        
+        A failed rebuild is recorded in reload_error and the current index is
+        kept; it is retried on the next call.
+        
+        Returns:
+            True if the files were reloaded
+        """
+        try:
+            if self._file_identity() == self.identity:
+                return False
+            self._load()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if error != self.reload_error:
+                logger.warning("Reloading %s failed, still serving the index loaded at %s: %s",
+                               self.excel2_path, self.loaded_at, error)
+            self.reload_error = error
+            return False
+        return True
+    
+    def health(self) -> Dict[str, Any]:
+        """
+        Describe the loaded reference.
+        
+        Returns:
+            Dict with the reference path, row count and load time. The status
+            is 'stale' with a reload_error when the files changed but could
+            not be reloaded.
+        """
+        self.reload_if_changed()
+        health = {'status': 'stale' if self.reload_error else 'ok', 'reference': self.excel2_path,
+                  'reference_rows': self.mapper.reference_rows(), 'loaded_at': self.loaded_at}
+        if self.reload_error:
+            health['reload_error'] = self.reload_error
+        return health
+    
+    def match(self, records: List[Dict[str, Any]], threshold: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Match records against the reference.
+        
+        Args:
+            records: Records keyed by df1 column names
+            threshold: Minimum similarity score (default: the service threshold)
+            
+        Returns:
+            Dict with the per-record matches and the time taken in milliseconds
+        """
+        started = time.perf_counter()
+        self.reload_if_changed()
+        threshold = self.threshold if threshold is None else int(threshold)
+        matches = self.mapper.match_records(records, threshold, self.candidate_sources)
+        return {'matches': matches, 'threshold': threshold,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)}
+    
+    def serve(self, host: str = '127.0.0.1', port: int = 8765):
+        """
+        Answer match requests over local HTTP until interrupted.
+        
+        Args:
+            host: Interface to bind (local only by default)
+            port: Port to listen on
+        """
+        server = HTTPServer((host, port), _MatchRequestHandler)
+        server.service = self
+        print(f"Match service listening on http://{host}:{server.server_port} (POST /match, GET /health)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
 
-def main():
+
+def main(argv: Optional[List[str]] = None):
     """
     Main function to run the fuzzy matching process.
+    
+    Args:
+        argv: Command line arguments (default: sys.argv[1:])
     """
+    parser = argparse.ArgumentParser(description="Fuzzy match two Excel files using a column mapping file.")
+    parser.add_argument('--batch', metavar='MANIFEST',
+                        help="Run every job in a manifest of excel1, excel2, mapping, output paths")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for --batch and --sheets")
+    parser.add_argument('--threshold', type=int, default=80, help="Minimum similarity score (0-100)")
+    parser.add_argument('--serve', nargs=2, metavar=('REFERENCE', 'MAPPING'),
+                        help="Serve match requests against a reference file over local HTTP")
+    parser.add_argument('--port', type=int, default=8765, help="Port for --serve")
+    parser.add_argument('--candidates', nargs='+', metavar='SOURCE',
+                        help="Candidate indexes for --serve, e.g. bktree or soundex:a2")
+    parser.add_argument('--sheets', nargs='+', metavar='SHEET',
+                        help="Reconcile these sheets of both workbooks in parallel, by name or "
+                             "0-based position ('*' for all common sheets)")
+    args = parser.parse_args(argv)
+    
+    if args.batch:
+        run_batch(args.batch, threshold=args.threshold, max_workers=args.workers)
+        return
+    
+    if args.serve:
+        MatchService(args.serve[0], args.serve[1], threshold=args.threshold,
+                     candidate_sources=args.candidates).serve(port=args.port)
+        return
+    
     # Example usage
     # --- IMPORTANT: REPLACE WITH YOUR ACTUAL FILE PATHS ---
     excel1_path = 'final_merged_0_june.xlsx'
     excel2_path = 'result_400_June5.xlsx'
     mapping_path = 'column_compare_crl_trial_09_xx.xlsx'
     
+    if args.sheets:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        # All-digit values select sheets by position, as resolve_sheets() accepts
+        sheets = '*' if args.sheets == ['*'] else [int(s) if s.isdigit() else s for s in args.sheets]
+        reconcile_sheets(excel1_path, excel2_path, mapping_path, sheets, threshold=args.threshold,
+                         output_path=f"fuzzy_match_results_x_{timestamp}.xlsx", max_workers=args.workers)
+        return
+    
     # Create mapper instance
     mapper = ExcelFuzzyMapper(excel1_path, excel2_path, mapping_path)
     
-    # Process mappings with 80% similarity threshold
-    results = mapper.process_mappings(threshold=80)
+    # Process mappings with 80% similarity threshold (or --threshold)
+    results = mapper.process_mappings(threshold=args.threshold)
     
     # --- FILENAME WITH TIMESTAMP ---
     # Get current time for the timestamp
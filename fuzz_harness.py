@@ -0,0 +1,454 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple, Any, Optional
+
+import pandas as pd
+
+from fuzz import ExcelFuzzyMapper
+
+# Default tolerances. Exact engines must reproduce the reference results;
+# approximate engines may lose some recall/precision. Time and memory are
+# compared with a saved baseline when one is given. Memory is the peak RSS
+# growth of a fresh process running the engine, so Arrow buffers and SQLite
+# caches count as well as Python objects.
+DEFAULT_TOLERANCES = {
+    'min_recall': 0.95,
+    'min_precision': 0.99,
+    'max_time_ratio': 1.5,
+    'max_memory_ratio': 1.5,
+}
+
+# Per-engine defaults on top of DEFAULT_TOLERANCES. Soundex-only candidates
+# miss keys whose names sound different and then pair with another row,
+# which costs about 15% of recall and precision on the generated data.
+ENGINE_TOLERANCES = {
+    'soundex': {'min_recall': 0.8, 'min_precision': 0.8},
+}
+
+FIRST_NAMES = ['John', 'Jane', 'Bob', 'Alice', 'Ravi', 'Priya', 'Chen', 'Maria', 'Omar', 'Lena']
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Brown', 'Sharma', 'Gupta', 'Wang', 'Garcia', 'Khan', 'Muller']
+CITIES = ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Mumbai', 'Delhi', 'London', 'Berlin']
+DEPARTMENTS = ['IT', 'HR', 'Finance', 'Operations', 'Legal']
+
+
+def _typo(rng: random.Random, value: str) -> str:
+    """
+    Introduce one random edit (substitution, deletion or insertion).
+    
+    Args:
+        rng: Random generator
+        value: String to change
+        
+    Returns:
+        The changed string
+    """
+    if not value:
+        return value
+    pos = rng.randrange(len(value))
+    edit = rng.choice(('sub', 'del', 'ins'))
+    char = rng.choice('abcdefghijklmnopqrstuvwxyz0123456789')
+    if edit == 'sub':
+        return value[:pos] + char + value[pos + 1:]
+    if edit == 'del':
+        return value[:pos] + value[pos + 1:]
+    return value[:pos] + char + value[pos:]
+
+
+def generate_dataset(workdir: str, rows1: int = 300, rows2: int = 300, typo_rate: float = 0.3,
+                     seed: int = 0) -> Tuple[str, str, str]:
+    """
+    Generate an excel1/excel2/mapping triple as CSV files.
+    
+    excel2 holds a shuffled, partly misspelled copy of the excel1 records
+    (upper/lower case changes, typos, abbreviated names) plus unrelated
+    distractor rows when rows2 > rows1.
+    
+    Args:
+        workdir: Directory to write the files to
+        rows1: Number of excel1 rows
+        rows2: Number of excel2 rows
+        typo_rate: Share of copied values that get a typo
+        seed: Random seed
+        
+    Returns:
+        Paths of (excel1, excel2, mapping)
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(max(rows1, rows2)):
+        records.append({
+            'id': f'INV{i:06d}',
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'city': rng.choice(CITIES),
+            'dept': rng.choice(DEPARTMENTS),
+            'amount': f'{rng.uniform(10, 10000):.2f}',
+        })
+    
+    df1 = pd.DataFrame({
+        'a1': [r['id'] for r in records[:rows1]],
+        'a2': [r['name'] for r in records[:rows1]],
+        'a3': [r['city'] for r in records[:rows1]],
+        'a10': ['Dept'] * rows1,
+        'a12': [r['dept'] for r in records[:rows1]],
+        'a4': [r['amount'] for r in records[:rows1]],
+    })
+    
+    copies = []
+    for r in records[:rows2]:
+        maybe = lambda v: _typo(rng, v) if rng.random() < typo_rate else v
+        first, last = r['name'].split(' ')
+        copies.append({
+            'b1': maybe(r['id'].lower()),
+            'b5': maybe(f'{first} {last[0]}.' if rng.random() < 0.3 else r['name']),
+            'b9': maybe(r['city'].upper() if rng.random() < 0.5 else r['city']),
+            'b6': maybe(f"Dept {r['dept']}"),
+            'b2': r['amount'],
+        })
+    rng.shuffle(copies)
+    df2 = pd.DataFrame(copies)
+    
+    mapping = pd.DataFrame({
+        'source_column': ['a1', 'a2', 'a3', 'a10+a12', 'a4'],
+        'target_column': ['b1', 'b5', 'b9', 'b6', 'b2'],
+        'description': ['Primary Key', 'Name', 'City', 'Department', 'Amount'],
+    })
+    
+    paths = tuple(os.path.join(workdir, name) for name in ('excel1.csv', 'excel2.csv', 'mapping.csv'))
+    for df, path in zip((df1, df2, mapping), paths):
+        df.to_csv(path, index=False)
+    return paths
+
+
+def run_reference(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """
+    The original O(N x M) engine: every df1 row is compared with every df2
+    row through fuzzy_match_rows, with no pruning or materialization.
+    """
+    mapper = ExcelFuzzyMapper(*paths)
+    mapping_rows = list(mapper.mapping_df.iterrows())
+    pk_source_cols = mapper.parse_mapping_expression(str(mapper.mapping_df.iloc[0]['source_column']))
+    pk_target_cols = mapper.parse_mapping_expression(str(mapper.mapping_df.iloc[0]['target_column']))
+    
+    results = []
+    for idx1, _ in mapper.df1.iterrows():
+        pk_value1 = mapper.get_concatenated_value(mapper.df1, pk_source_cols, idx1)
+        best_match_idx = None
+        best_match_score = 0
+        for idx2, _ in mapper.df2.iterrows():
+            pk_value2 = mapper.get_concatenated_value(mapper.df2, pk_target_cols, idx2)
+            is_match, score = mapper.fuzzy_match_rows(pk_value1, pk_value2, threshold)
+            if is_match and score > best_match_score:
+                best_match_idx = idx2
+                best_match_score = score
+        if best_match_idx is None:
+            continue
+        
+        row_result = {'df1_row_index': idx1, 'df2_row_index': best_match_idx,
+                      'primary_key_score': best_match_score, 'primary_key_value': pk_value1}
+        for mapping_idx, mapping_row in mapping_rows:
+            if mapping_idx == 0:
+                continue
+            source_expr = str(mapping_row['source_column'])
+            target_expr = str(mapping_row['target_column'])
+            value1 = mapper.get_concatenated_value(mapper.df1, mapper.parse_mapping_expression(source_expr), idx1)
+            value2 = mapper.get_concatenated_value(mapper.df2, mapper.parse_mapping_expression(target_expr), best_match_idx)
+            is_match, score = mapper.fuzzy_match_rows(value1, value2, threshold)
+            row_result[f'mapping_{source_expr}_to_{target_expr}_score'] = score
+            row_result[f'mapping_{source_expr}_to_{target_expr}_match'] = is_match
+            row_result[f'value1_{source_expr}'] = value1
+            row_result[f'value2_{target_expr}'] = value2
+        results.append(row_result)
+    return pd.DataFrame(results)
+
+
+def run_pruned(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Default process_mappings: materialized keys with length-bound pruning."""
+    return ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False)
+
+
+def run_low_memory(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """process_mappings on frames loaded with the low_memory profile."""
+    return ExcelFuzzyMapper(*paths, load_profile='low_memory').process_mappings(threshold, show_progress=False)
+
+
+def run_reference_store(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """process_mappings with df2 in the on-disk SQLite reference store."""
+    mapper = ExcelFuzzyMapper(*paths, reference_store=os.path.join(workdir, 'reference.db'))
+    return mapper.process_mappings(threshold, show_progress=False)
+
+
+def run_bidirectional(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Bidirectional process_mappings, without its extra mutual-best columns."""
+    results = ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False, bidirectional=True)
+    return results.drop(columns=['df2_best_df1_row_index', 'df2_best_score', 'mutual_best'])
+
+
+def run_reanalyze(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Results replayed from a score store saved at a higher threshold."""
+    mapper = ExcelFuzzyMapper(*paths)
+    score_store_path = os.path.join(workdir, 'scores')
+    mapper.process_mappings(min(threshold + 5, 100), show_progress=False,
+                            score_store_path=score_store_path, score_floor=threshold)
+    return mapper.reanalyze(score_store_path, threshold)
+
+
+def run_bktree(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """process_mappings with candidates from the BK-tree edit-distance index."""
+    return ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False, candidate_sources=['bktree'])
+
+
+def run_bktree_soundex(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Candidates from the BK-tree on the key unioned with Soundex codes of the name mapping."""
+    return ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False,
+                                                     candidate_sources=['bktree', 'soundex:a2'])
+
+
+def run_soundex(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Candidates from Soundex codes of the name mapping only; rows whose names sound different are missed."""
+    return ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False,
+                                                     candidate_sources=['soundex:a2'])
+
+
+def run_cascade(paths: Tuple[str, str, str], threshold: int, workdir: str) -> pd.DataFrame:
+    """Cascade pairing; the generated mapping has no comparators, so only the key pairs."""
+    results = ExcelFuzzyMapper(*paths).process_mappings(threshold, show_progress=False, pairing='cascade')
+    return results.drop(columns=['composite_score'])
+
+
+# name -> (engine, is_approximate)
+ENGINES: Dict[str, Tuple[Callable[[Tuple[str, str, str], int, str], pd.DataFrame], bool]] = {
+    'reference': (run_reference, False),
+    'pruned': (run_pruned, False),
+    'low_memory': (run_low_memory, False),
+    'reference_store': (run_reference_store, False),
+    'bidirectional': (run_bidirectional, False),
+    'reanalyze': (run_reanalyze, False),
+    'bktree': (run_bktree, False),
+    'bktree_soundex': (run_bktree_soundex, False),
+    'soundex': (run_soundex, True),
+    'cascade': (run_cascade, False),
+}
+
+
+def _normalize(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make results from different engines comparable cell by cell.
+    
+    Args:
+        results: Results DataFrame
+        
+    Returns:
+        Copy with every cell as a string, sorted by df1 row
+    """
+    if results.empty:
+        return pd.DataFrame(columns=results.columns)
+    normalized = results.astype(object).map(lambda v: '' if v is None or (isinstance(v, float) and v != v) else str(v))
+    return normalized.sort_values('df1_row_index', key=lambda s: s.astype(int)).reset_index(drop=True)
+
+
+def compare_results(reference: pd.DataFrame, candidate: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Diff an engine's results against the reference engine row by row.
+    
+    Args:
+        reference: Results of the reference engine
+        candidate: Results of the engine under test
+        
+    Returns:
+        Dict with pair recall and precision and the number of differing rows
+    """
+    ref_pairs = set(zip(reference.get('df1_row_index', []), reference.get('df2_row_index', [])))
+    cand_pairs = set(zip(candidate.get('df1_row_index', []), candidate.get('df2_row_index', [])))
+    common = ref_pairs & cand_pairs
+    
+    ref_norm = _normalize(reference).set_index('df1_row_index') if len(reference) else pd.DataFrame()
+    cand_norm = _normalize(candidate).set_index('df1_row_index') if len(candidate) else pd.DataFrame()
+    columns_match = list(reference.columns) == list(candidate.columns)
+    rows = ref_norm.index.union(cand_norm.index)
+    differing = []
+    if columns_match:
+        ref_aligned = ref_norm.reindex(rows)
+        cand_aligned = cand_norm.reindex(rows)
+        mismatch = (ref_aligned != cand_aligned).any(axis=1)
+        differing = list(rows[mismatch.to_numpy()])
+    
+    return {
+        'recall': len(common) / len(ref_pairs) if ref_pairs else 1.0,
+        'precision': len(common) / len(cand_pairs) if cand_pairs else 1.0,
+        'columns_match': columns_match,
+        'differing_rows': len(differing) if columns_match else len(rows),
+        'first_differing_rows': [int(r) for r in differing[:10]],
+    }
+
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _measure_memory(name: str, paths: Tuple[str, str, str], threshold: int, workdir: str) -> int:
+    """
+    Run an engine in this (fresh) process and return how far its peak RSS
+    rose above the RSS before the run.
+    """
+    before = _current_rss()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ENGINES[name][0](paths, threshold, workdir)
+    # ru_maxrss is in KiB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - before, 0)
+
+
+def _measure(name: str, paths: Tuple[str, str, str], threshold: int,
+             workdir: str) -> Tuple[pd.DataFrame, float, int]:
+    """
+    Run an engine twice: once here for its results and wall time, and once
+    in a newly spawned process for its peak memory, so the timing is not
+    slowed by any memory accounting and earlier engines do not raise the peak.
+    
+    Returns:
+        Tuple of (results, seconds, peak RSS increase in bytes)
+    """
+    time_dir, memory_dir = os.path.join(workdir, 'time'), os.path.join(workdir, 'memory')
+    os.makedirs(time_dir)
+    os.makedirs(memory_dir)
+    
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = ENGINES[name][0](paths, threshold, time_dir)
+    seconds = time.perf_counter() - started
+    
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        peak = executor.submit(_measure_memory, name, paths, threshold, memory_dir).result()
+    return results, seconds, peak
+
+
+def run_harness(engines: Optional[List[str]] = None, rows1: int = 300, rows2: int = 300,
+                threshold: int = 80, seed: int = 0, typo_rate: float = 0.3,
+                tolerances: Optional[Dict[str, float]] = None,
+                baseline: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run the reference engine and the selected engines on a generated dataset,
+    diff their results and check them against the tolerances.
+    
+    Args:
+        engines: Engine names from ENGINES (default: all)
+        rows1: Generated excel1 rows
+        rows2: Generated excel2 rows
+        threshold: Minimum similarity score (0-100)
+        seed: Random seed for the dataset
+        typo_rate: Share of copied values with a typo
+        tolerances: Overrides for DEFAULT_TOLERANCES and ENGINE_TOLERANCES
+        baseline: Report of an earlier run to compare time and memory with
+        
+    Returns:
+        Report dict with one entry per engine and an overall 'passed' flag
+    """
+    overrides = tolerances or {}
+    tolerances = dict(DEFAULT_TOLERANCES, **overrides)
+    engines = [name for name in (engines or list(ENGINES)) if name != 'reference']
+    baseline_engines = (baseline or {}).get('engines', {})
+    
+    report = {'rows1': rows1, 'rows2': rows2, 'threshold': threshold, 'seed': seed,
+              'tolerances': tolerances, 'engines': {}, 'passed': True}
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = generate_dataset(workdir, rows1, rows2, typo_rate, seed)
+        reference_dir = os.path.join(workdir, 'reference')
+        os.makedirs(reference_dir)
+        reference, seconds, peak = _measure('reference', paths, threshold, reference_dir)
+        report['engines']['reference'] = {'seconds': round(seconds, 3), 'peak_bytes': peak,
+                                          'matches': len(reference), 'failures': []}
+        
+        for name in engines:
+            approximate = ENGINES[name][1]
+            engine_dir = os.path.join(workdir, name)
+            os.makedirs(engine_dir)
+            results, seconds, peak = _measure(name, paths, threshold, engine_dir)
+            diff = compare_results(reference, results)
+            
+            failures = []
+            if approximate:
+                limits = {**tolerances, **ENGINE_TOLERANCES.get(name, {}), **overrides}
+                if diff['recall'] < limits['min_recall']:
+                    failures.append(f"recall {diff['recall']:.4f} < {limits['min_recall']}")
+                if diff['precision'] < limits['min_precision']:
+                    failures.append(f"precision {diff['precision']:.4f} < {limits['min_precision']}")
+            elif diff['differing_rows']:
+                failures.append(f"{diff['differing_rows']} rows differ from the reference engine")
+            
+            previous = baseline_engines.get(name)
+            if previous:
+                if seconds > previous['seconds'] * tolerances['max_time_ratio']:
+                    failures.append(f"time {seconds:.3f}s > {tolerances['max_time_ratio']}x baseline {previous['seconds']}s")
+                if peak > previous['peak_bytes'] * tolerances['max_memory_ratio']:
+                    failures.append(f"peak memory {peak} > {tolerances['max_memory_ratio']}x baseline {previous['peak_bytes']}")
+            
+            report['engines'][name] = dict(diff, seconds=round(seconds, 3), peak_bytes=peak,
+                                           matches=len(results), approximate=approximate,
+                                           speedup=round(report['engines']['reference']['seconds'] / seconds, 2)
+                                           if seconds > 0 else None,
+                                           failures=failures)
+            report['passed'] = report['passed'] and not failures
+    
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point.
+    
+    Args:
+        argv: Command line arguments (default: sys.argv[1:])
+        
+    Returns:
+        Process exit code: 0 if every engine is within tolerance, 1 otherwise
+    """
+    parser = argparse.ArgumentParser(description="Check scoring engines against the reference fuzz.ratio loop.")
+    parser.add_argument('--engines', nargs='*', default=None, help=f"Engines to run ({', '.join(ENGINES)})")
+    parser.add_argument('--rows1', type=int, default=300, help="Generated excel1 rows")
+    parser.add_argument('--rows2', type=int, default=300, help="Generated excel2 rows")
+    parser.add_argument('--threshold', type=int, default=80, help="Minimum similarity score (0-100)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the dataset")
+    parser.add_argument('--tolerances', type=json.loads, default=None,
+                        help="JSON object overriding " + ', '.join(DEFAULT_TOLERANCES))
+    parser.add_argument('--baseline', help="Report JSON of an earlier run to compare time and memory with")
+    parser.add_argument('--output', help="Write the report JSON here")
+    args = parser.parse_args(argv)
+    
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    
+    report = run_harness(args.engines, args.rows1, args.rows2, args.threshold, args.seed,
+                         tolerances=args.tolerances, baseline=baseline)
+    
+    for name, result in report['engines'].items():
+        status = 'FAIL' if result['failures'] else 'ok'
+        line = f"{name:16} {status:4} {result['seconds']:8.3f}s {result['peak_bytes'] / 2**20:8.1f} MiB {result['matches']:6} matches"
+        if name != 'reference':
+            line += f"  recall {result['recall']:.4f} precision {result['precision']:.4f} x{result['speedup']}"
+        print(line)
+        for failure in result['failures']:
+            print(f"    {failure}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    return 0 if report['passed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,232 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import timeit
+
 from PIL import Image
-from PIL import ExifTags # To interpret EXIF tags if necessary
 
-def get_image_dpi(image_path):
+# EXIF/TIFF tag ids of the resolution fields (ExifTags.Base.XResolution etc.),
+# so lookups do not have to search ExifTags.TAGS by name
+X_RESOLUTION = 0x011A
+Y_RESOLUTION = 0x011B
+RESOLUTION_UNIT = 0x0128
+
+# Extensions scanned when config.py cannot be imported
+_DEFAULT_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+# Byte size of the TIFF field types the resolution tags use
+_TIFF_TYPE_SIZES = {3: 2, 4: 4, 5: 8, 10: 8}
+
+
+class _UnknownFormat(Exception):
+    """The file is not a format the header parser understands."""
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise struct.error("Unexpected end of file")
+    return data
+
+
+def _read_ifd0_tags(read_at, tags):
     """
-    Fetches the DPI of an image.
-    Returns a tuple (horizontal_dpi, vertical_dpi) or (dpi, dpi) if uniform,
-    or None if DPI information is not found.
+    Read the first value of some tags from the first IFD of a TIFF structure.
+
+    read_at(offset, size) returns bytes of the TIFF structure, so the same
+    code reads a TIFF file (via seeks) or an EXIF block (from memory).
+    Returns a dict of tag id -> int or float, missing tags are left out.
+    """
+    byte_order = read_at(0, 2)
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        raise _UnknownFormat("Not a TIFF structure")
+    magic, ifd_offset = struct.unpack(endian + 'HI', read_at(2, 6))
+    if magic != 42:
+        raise _UnknownFormat("Not a classic TIFF structure")
+
+    (entry_count,) = struct.unpack(endian + 'H', read_at(ifd_offset, 2))
+    entries = read_at(ifd_offset + 2, entry_count * 12)
+    values = {}
+    for pos in range(0, entry_count * 12, 12):
+        tag, field_type, count = struct.unpack(endian + 'HHI', entries[pos:pos + 8])
+        if tag not in tags or count < 1 or field_type not in _TIFF_TYPE_SIZES:
+            continue
+        size = _TIFF_TYPE_SIZES[field_type]
+        raw = entries[pos + 8:pos + 12]
+        if size > 4:
+            raw = read_at(struct.unpack(endian + 'I', raw)[0], size)
+        if field_type == 3:
+            values[tag] = struct.unpack(endian + 'H', raw[:2])[0]
+        elif field_type == 4:
+            values[tag] = struct.unpack(endian + 'I', raw)[0]
+        else:
+            numerator, denominator = struct.unpack(endian + ('ii' if field_type == 10 else 'II'), raw)
+            # Leave zero denominators to Pillow
+            values[tag] = numerator / denominator
+    return values
+
+
+def _exif_block_dpi(exif):
+    """
+    DPI from an EXIF block the way the EXIF fallback of get_image_dpi reads it.
+    Returns (x_dpi, y_dpi) or None.
+    """
+    def read_at(offset, size):
+        data = exif[offset:offset + size]
+        if len(data) != size:
+            raise struct.error("Truncated EXIF block")
+        return data
+
+    values = _read_ifd0_tags(read_at, (X_RESOLUTION, Y_RESOLUTION, RESOLUTION_UNIT))
+    x_res = values.get(X_RESOLUTION)
+    y_res = values.get(Y_RESOLUTION)
+    if x_res and y_res:
+        unit = values.get(RESOLUTION_UNIT)
+        if unit == 2:  # Inches
+            return (x_res, y_res)
+        elif unit == 3:  # Centimeters
+            return (x_res * 2.54, y_res * 2.54)
+        elif x_res > 50 and y_res > 50:
+            return (x_res, y_res)
+    return None
+
+
+def _jpeg_header_dpi(f):
+    """Read the APP0/JFIF and APP1/EXIF segments in front of the image data."""
+    jfif = None
+    exif = None
+    _read_exact(f, 2)  # SOI
+    while True:
+        marker = _read_exact(f, 2)
+        while marker[0] == 0xFF and marker[1] == 0xFF:  # fill bytes
+            marker = marker[1:] + _read_exact(f, 1)
+        if marker[0] != 0xFF:
+            raise struct.error("Invalid JPEG marker")
+        code = marker[1]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # markers without a length
+            continue
+        if code in (0xDA, 0xD9):  # start of scan / end of image
+            break
+        (length,) = struct.unpack('>H', _read_exact(f, 2))
+        if code == 0xE0 and jfif is None or code == 0xE1 and exif is None:
+            data = _read_exact(f, length - 2)
+            if code == 0xE0 and data.startswith(b'JFIF') and len(data) >= 12:
+                jfif = (data[7], struct.unpack('>HH', data[8:12]))
+            elif code == 0xE1 and data.startswith(b'Exif\0\0'):
+                exif = data[6:]
+        else:
+            f.seek(length - 2, 1)
+
+    if jfif is not None:
+        unit, density = jfif
+        if unit == 1:  # Dots Per Inch
+            return density, 'jfif'
+        elif unit == 2:  # Dots Per Centimeter
+            return tuple(d * 2.54 for d in density), 'jfif'
+    if exif is not None:
+        # Pillow takes the DPI of a JPEG without JFIF density from the EXIF
+        # XResolution and ResolutionUnit, and assumes 72 if they are unusable
+        try:
+            values = _read_ifd0_tags(lambda offset, size: exif[offset:offset + size],
+                                     (X_RESOLUTION, RESOLUTION_UNIT))
+            dpi = values[X_RESOLUTION]
+            if values[RESOLUTION_UNIT] == 3:
+                dpi *= 2.54
+            if dpi != dpi:
+                raise ValueError("DPI is not a number")
+            return (dpi, dpi), 'exif'
+        except (struct.error, KeyError, ValueError, ZeroDivisionError, _UnknownFormat):
+            return (72, 72), 'exif'
+    return None, 'none'
+
+
+def _png_header_dpi(f):
+    """Read the pHYs chunk (and an eXIf chunk if there is no pHYs DPI)."""
+    _read_exact(f, 8)  # signature
+    exif = None
+    seen_image_data = False
+    while True:
+        length, chunk_type = struct.unpack('>I4s', _read_exact(f, 8))
+        if chunk_type == b'IDAT':
+            # Pillow stops reading metadata here, except for eXIf
+            seen_image_data = True
+            f.seek(length + 4, 1)
+        elif chunk_type == b'pHYs' and not seen_image_data:
+            data = _read_exact(f, length)
+            if length < 9:
+                raise ValueError("Truncated pHYs chunk")
+            px, py, unit = struct.unpack('>IIB', data[:9])
+            if unit == 1:  # Pixels per meter
+                return (px * 0.0254, py * 0.0254), 'png'
+            f.seek(4, 1)
+        elif chunk_type == b'eXIf' and exif is None:
+            exif = _read_exact(f, length)
+            f.seek(4, 1)
+        elif chunk_type == b'IEND':
+            break
+        else:
+            f.seek(length + 4, 1)
+
+    if exif is not None:
+        dpi = _exif_block_dpi(exif)
+        if dpi:
+            return dpi, 'exif'
+    return None, 'none'
+
+
+def _tiff_header_dpi(f):
+    """Read the resolution entries of the first IFD."""
+    def read_at(offset, size):
+        f.seek(offset)
+        return _read_exact(f, size)
+
+    values = _read_ifd0_tags(read_at, (X_RESOLUTION, Y_RESOLUTION, RESOLUTION_UNIT))
+    # Pillow treats missing resolution tags as 1
+    x_res = values.get(X_RESOLUTION, 1)
+    y_res = values.get(Y_RESOLUTION, 1)
+    if x_res and y_res:
+        unit = values.get(RESOLUTION_UNIT)
+        if unit == 2 or unit is None:  # Inches (the default)
+            return (x_res, y_res), 'tiff'
+        elif unit == 3:  # Centimeters
+            return (x_res * 2.54, y_res * 2.54), 'tiff'
+    return None, 'none'
+
+
+def _header_dpi(image_path):
+    """
+    Read the DPI from the file header without decoding the image.
+    Returns (dpi, source), raises _UnknownFormat for other formats.
+    """
+    with open(image_path, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        if signature[:2] == b'\xff\xd8':
+            return _jpeg_header_dpi(f)
+        if signature == b'\x89PNG\r\n\x1a\n':
+            return _png_header_dpi(f)
+        if signature[:4] in (b'II*\x00', b'MM\x00*'):
+            return _tiff_header_dpi(f)
+    raise _UnknownFormat(f"Unrecognized image format: {image_path}")
+
+
+def _pillow_dpi(image_path):
     """
+    Fetches the DPI of an image through Pillow.
+    Returns a tuple (horizontal_dpi, vertical_dpi) or None.
+    """
+    img = Image.open(image_path)
     try:
-        img = Image.open(image_path)
         dpi_info = img.info.get('dpi')
 
         if dpi_info:
@@ -28,26 +246,18 @@ def get_image_dpi(image_path):
             elif unit == 2:  # Dots Per Centimeter
                 return (x_density * 2.54, y_density * 2.54)
 
-        # Try to get from EXIF data if available (common in TIFFs, some JPEGs)
+        # Try to get from EXIF data if available (common in TIFFs, some JPEGs).
+        # getexif() only reads the first IFD, where the resolution tags live,
+        # instead of decoding every EXIF sub-IFD like _getexif(). It is only
+        # used for the formats that have _getexif(), as before: on a TIFF it
+        # would return the image tags, and apply the heuristic below to
+        # resolutions the file says have no absolute unit
         try:
-            exif_data = img._getexif()
+            exif_data = img.getexif() if hasattr(img, '_getexif') else None
             if exif_data:
-                x_resolution_tag = None
-                y_resolution_tag = None
-                resolution_unit_tag = None
-
-                # Find the tag IDs for resolution
-                for tag_id, name in ExifTags.TAGS.items():
-                    if name == "XResolution":
-                        x_resolution_tag = tag_id
-                    elif name == "YResolution":
-                        y_resolution_tag = tag_id
-                    elif name == "ResolutionUnit":
-                        resolution_unit_tag = tag_id
-
-                x_resolution_val = exif_data.get(x_resolution_tag)
-                y_resolution_val = exif_data.get(y_resolution_tag)
-                resolution_unit_val = exif_data.get(resolution_unit_tag)
+                x_resolution_val = exif_data.get(X_RESOLUTION)
+                y_resolution_val = exif_data.get(Y_RESOLUTION)
+                resolution_unit_val = exif_data.get(RESOLUTION_UNIT)
 
                 if x_resolution_val and y_resolution_val:
                     # Resolution value is often a tuple (numerator, denominator)
@@ -75,28 +285,440 @@ def get_image_dpi(image_path):
             pass
             
         return None # DPI not found
+    finally:
+        img.close()
+
+
+def _detect_dpi(image_path):
+    """
+    Finds the DPI of an image and where it came from.
+    JPEG, PNG and TIFF headers are parsed directly, reading only the
+    metadata bytes; other formats, and headers the parser cannot make
+    sense of, go through Pillow.
+    Returns a tuple (dpi, source) where dpi is (horizontal_dpi, vertical_dpi)
+    or None, and source is 'jfif', 'exif', 'png', 'tiff', 'pillow' or 'none'.
+    """
+    try:
+        return _header_dpi(image_path)
+    except FileNotFoundError:
+        raise
+    except (_UnknownFormat, struct.error, ValueError, ZeroDivisionError, OSError):
+        dpi = _pillow_dpi(image_path)
+        return dpi, 'pillow' if dpi else 'none'
+
+
+def _file_digest(image_path):
+    digest = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DPICache:
+    """
+    On-disk cache of detected DPI values in an SQLite database.
+    With key='stat' an entry is reused while the file's absolute path, size
+    and mtime are unchanged, so a hit does not open the file at all. With
+    key='hash' entries are looked up by the SHA-1 of the file contents,
+    which survives copies and touches but reads the whole file.
+    Images without DPI are cached too; files that fail to parse are not.
+    Whether each value was an int is stored with it, so a hit returns the
+    same types as _detect_dpi(); rational values come back as floats.
+    """
+
+    def __init__(self, db_path, key='stat'):
+        if key not in ('stat', 'hash'):
+            raise ValueError(f"Unknown cache key: {key}")
+        self.db_path = db_path
+        self.key = key
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dpi_cache ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, "
+            "dpi_x REAL, dpi_y REAL, source TEXT, int_x INTEGER, int_y INTEGER)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(dpi_cache)")}
+        if 'int_x' not in columns:
+            # Caches written before the value types were stored: their rows
+            # have no int_x and are treated as misses until rewritten
+            self.conn.execute("ALTER TABLE dpi_cache ADD COLUMN int_x INTEGER")
+            self.conn.execute("ALTER TABLE dpi_cache ADD COLUMN int_y INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS dpi_cache_digest ON dpi_cache (digest)")
+        self.conn.commit()
+
+    def file_key(self, image_path):
+        """The (path, size, mtime_ns, digest) a file is cached under."""
+        st = os.stat(image_path)
+        digest = _file_digest(image_path) if self.key == 'hash' else None
+        return os.path.abspath(image_path), st.st_size, st.st_mtime_ns, digest
+
+    def lookup(self, file_key):
+        """Returns the cached (dpi, source) for a file_key(), or None."""
+        path, size, mtime_ns, digest = file_key
+        if self.key == 'hash':
+            row = self.conn.execute(
+                "SELECT dpi_x, dpi_y, source, int_x, int_y FROM dpi_cache "
+                "WHERE digest = ? AND int_x IS NOT NULL LIMIT 1", (digest,)
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT dpi_x, dpi_y, source, int_x, int_y FROM dpi_cache "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? AND int_x IS NOT NULL",
+                (path, size, mtime_ns),
+            ).fetchone()
+        if row is None:
+            return None
+        dpi_x, dpi_y, source, int_x, int_y = row
+        if dpi_x is None:
+            return None, source
+        return (int(dpi_x) if int_x else dpi_x, int(dpi_y) if int_y else dpi_y), source
+
+    def store(self, file_key, dpi, source, commit=True):
+        """Caches the (dpi, source) found for a file_key()."""
+        dpi_x, dpi_y = (float(dpi[0]), float(dpi[1])) if dpi else (None, None)
+        int_x, int_y = (isinstance(dpi[0], int), isinstance(dpi[1], int)) if dpi else (False, False)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dpi_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*file_key, dpi_x, dpi_y, source, int_x, int_y),
+        )
+        if commit:
+            self.conn.commit()
+
+    def detect(self, image_path):
+        """_detect_dpi() through the cache. Returns (dpi, source, cached)."""
+        dpi, source, cached, file_key = _cached_detect(self, image_path)
+        if not cached:
+            self.store(file_key, dpi, source)
+        return dpi, source, cached
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _cached_detect(cache, image_path):
+    file_key = cache.file_key(image_path)
+    hit = cache.lookup(file_key)
+    if hit is not None:
+        return hit + (True, file_key)
+    return _detect_dpi(image_path) + (False, file_key)
 
+
+def get_image_dpi(image_path, cache=None):
+    """
+    Fetches the DPI of an image.
+    Returns a tuple (horizontal_dpi, vertical_dpi) or (dpi, dpi) if uniform,
+    or None if DPI information is not found. With a DPICache, files it has
+    already seen are answered from the cache without reading the image.
+    """
+    try:
+        if cache is not None:
+            return cache.detect(image_path)[0]
+        return _detect_dpi(image_path)[0]
     except FileNotFoundError:
         print(f"Error: Image file not found at {image_path}")
         return None
     except Exception as e:
         print(f"An error occurred while processing {image_path}: {e}")
         return None
+
+
+def supported_extensions():
+    """
+    The file extensions the batch scanner picks up, lower case.
+    Taken from SUPPORTED_FILE_EXTENSIONS in config.py; config.py pulls in
+    the Vertex AI settings, so it is only imported here and the scanner
+    falls back to the common image extensions if it is not importable.
+    """
+    try:
+        from config import SUPPORTED_FILE_EXTENSIONS
+    except ImportError:
+        return _DEFAULT_EXTENSIONS
+    return tuple(ext.lower() for ext in SUPPORTED_FILE_EXTENSIONS)
+
+
+def iter_image_files(paths, extensions=None):
+    """
+    Yields the image files under some files and directories.
+    Directories are walked recursively and files are kept when their
+    extension is in extensions (supported_extensions() by default); paths
+    given as files are yielded as they are.
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    if extensions is None:
+        extensions = supported_extensions()
+    extensions = tuple(ext.lower() for ext in extensions)
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.fspath(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(extensions):
+                    yield os.path.join(dirpath, filename)
+
+
+def _scan(image_path, cache=None):
+    record = {'path': image_path, 'dpi': None, 'source': 'none', 'error': None}
+    file_key = dpi = None
+    if cache is not None:
+        record['cached'] = False
+    try:
+        if cache is None:
+            dpi, record['source'] = _detect_dpi(image_path)
+        else:
+            dpi, record['source'], record['cached'], file_key = _cached_detect(cache, image_path)
+        if dpi:
+            record['dpi'] = [float(value) for value in dpi]
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    # The detected dpi is passed on as well, for the cache to keep its types
+    return record, file_key, dpi
+
+
+def scan_image(image_path, cache=None):
+    """
+    Finds the DPI of one image for the batch scanner.
+    Returns a dict with the path, dpi as [horizontal, vertical] floats or
+    None, the source of the value (see _detect_dpi) and an error message
+    or None. Errors are recorded instead of raised. With a DPICache the
+    record also says whether it was 'cached', and new results are stored.
+    """
+    record, file_key, dpi = _scan(image_path, cache)
+    if cache is not None and file_key is not None and not record['cached']:
+        cache.store(file_key, dpi, record['source'])
+    return record
+
+
+# Read-only cache connection of a scan_dpi() worker process
+_worker_cache = None
+
+
+def _init_scan_worker(db_path, key):
+    global _worker_cache
+    _worker_cache = DPICache(db_path, key)
+
+
+def _scan_in_worker(image_path):
+    return _scan(image_path, _worker_cache)
+
+
+def scan_dpi(paths, extensions=None, workers=None, chunksize=32, cache=None,
+             changed_only=False, commit_every=500):
+    """
+    Finds the DPI of every image under some files and directories.
+    The files are spread over a pool of worker processes and the
+    scan_image() records are yielded as they finish, in no particular
+    order, so nothing is collected in memory. workers=1 scans in this
+    process.
+    With a DPICache, workers answer unchanged files from the cache without
+    opening them, and this process stores the new results, committing every
+    commit_every of them. changed_only=True leaves the cached files out of
+    the output.
+    """
+    image_paths = iter_image_files(paths, extensions)
+    if workers == 1:
+        results = (_scan(image_path, cache) for image_path in image_paths)
+        pool = None
+    elif cache is None:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_scan_in_worker, image_paths, chunksize)
+    else:
+        pool = multiprocessing.Pool(workers, _init_scan_worker, (cache.db_path, cache.key))
+        results = pool.imap_unordered(_scan_in_worker, image_paths, chunksize)
+
+    try:
+        pending = 0
+        for record, file_key, dpi in results:
+            if cache is not None and file_key is not None and not record['cached']:
+                cache.store(file_key, dpi, record['source'], commit=False)
+                pending += 1
+                if pending >= commit_every:
+                    cache.conn.commit()
+                    pending = 0
+            if changed_only and record.get('cached'):
+                continue
+            yield record
     finally:
-        if 'img' in locals() and img:
-            img.close()
+        if cache is not None:
+            cache.conn.commit()
+        if pool is not None:
+            pool.terminate()
+
+
+def write_scan(records, output):
+    """
+    Writes scan records to a text stream as JSON lines, flushing each one.
+    Returns the number of records written.
+    """
+    count = 0
+    for record in records:
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        count += 1
+    return count
+
+
+def benchmark(image_paths, number=1000):
+    """
+    Micro-benchmark of the DPI lookup steps on some images.
+    Times the old per-call ExifTags.TAGS scan against the tag constants,
+    _getexif() against getexif() with three lookups, and the header parser
+    against the Pillow path. Returns a list of (step, microseconds per call).
+    """
+    from PIL import ExifTags
+
+    def scan_tags():
+        tags = {}
+        for tag_id, name in ExifTags.TAGS.items():
+            if name in ("XResolution", "YResolution", "ResolutionUnit"):
+                tags[name] = tag_id
+        return tags
+
+    def per_call(func):
+        return timeit.timeit(func, number=number) / number * 1e6
+
+    timings = [
+        ("tag ids: scan ExifTags.TAGS", per_call(scan_tags)),
+        ("tag ids: constants", per_call(lambda: (X_RESOLUTION, Y_RESOLUTION, RESOLUTION_UNIT))),
+    ]
+    for image_path in image_paths:
+        with Image.open(image_path) as img:
+            if hasattr(img, '_getexif'):
+                timings.append((f"{image_path}: _getexif()", per_call(lambda: img._getexif())))
+            timings.append((f"{image_path}: getexif() + 3 tags", per_call(
+                lambda: [img.getexif().get(tag) for tag in (X_RESOLUTION, Y_RESOLUTION, RESOLUTION_UNIT)])))
+        timings.append((f"{image_path}: header parser", per_call(lambda: _detect_dpi(image_path))))
+        timings.append((f"{image_path}: Pillow", per_call(lambda: _pillow_dpi(image_path))))
+    return timings
+
+def _check_images(directory):
+    """
+    Writes small JPEG (JFIF and Exif), PNG (pHYs) and TIFF images with
+    known resolutions into directory and returns their paths.
+    """
+    image = Image.new('RGB', (8, 8), 'white')
+    paths = []
+
+    def save(name, **params):
+        path = os.path.join(directory, name)
+        image.save(path, **params)
+        paths.append(path)
+
+    save('jfif_inch.jpg', dpi=(300, 200))
+    save('jfif_none.jpg')
+    for name, x_res, y_res, unit in (('exif_inch.jpg', 240, 180, 2),
+                                     ('exif_cm.jpg', 118, 59, 3),
+                                     ('exif_no_unit.jpg', 96, 96, None)):
+        exif = Image.Exif()
+        exif[X_RESOLUTION] = x_res
+        exif[Y_RESOLUTION] = y_res
+        if unit is not None:
+            exif[RESOLUTION_UNIT] = unit
+        save(name, exif=exif.tobytes())
+    save('phys.png', dpi=(300, 150))
+    save('phys_fraction.png', dpi=(72.5, 96.25))
+    save('no_phys.png')
+    save('tiff_inch.tif', dpi=(600, 300))
+    save('tiff_cm.tif', resolution_unit=3, x_resolution=40, y_resolution=20)
+    return paths
+
+
+def check_header_parser(image_paths=None):
+    """
+    Regression check of the header parsers against the Pillow path.
+    Compares _header_dpi with _pillow_dpi on the images given, or on
+    generated JPEG, PNG and TIFF images when there are none, rounding
+    both to two decimals. Images the header parser leaves to Pillow are
+    skipped, as _detect_dpi does not use the parser for them. Returns a list of (path, header_dpi, pillow_dpi)
+    for the images where they disagree.
+    """
+    def rounded(dpi):
+        return None if dpi is None else tuple(round(float(value), 2) for value in dpi)
+
+    def compare(paths):
+        mismatches = []
+        for image_path in paths:
+            try:
+                header_dpi = _header_dpi(image_path)[0]
+            except FileNotFoundError:
+                raise
+            except (_UnknownFormat, struct.error, ValueError, ZeroDivisionError, OSError):
+                continue
+            pillow_dpi = _pillow_dpi(image_path)
+            if rounded(header_dpi) != rounded(pillow_dpi):
+                mismatches.append((image_path, header_dpi, pillow_dpi))
+        return mismatches
+
+    if image_paths:
+        return compare(image_paths)
+    with tempfile.TemporaryDirectory() as directory:
+        return compare(_check_images(directory))
 
 # --- How to use the function ---
 if __name__ == "__main__":
-    # Replace "path/to/your/image_c105a7.png" with the actual path to your image
-    image_file_path = "image.png"  # <--- CHANGE THIS
+    parser = argparse.ArgumentParser(description="Print the DPI of images.")
+    # Replace "image.png" with the actual path to your image, or pass paths
+    parser.add_argument('images', nargs='*', default=["image.png"], help="Image files")
+    parser.add_argument('--bench', action='store_true', help="Time the DPI lookup steps on the images")
+    parser.add_argument('--number', type=int, default=1000, help="Calls per step for --bench")
+    parser.add_argument('--check', action='store_true',
+                        help="Check the header parsers against Pillow on generated images, "
+                             "or on the images given")
+    parser.add_argument('--scan', action='store_true',
+                        help="Scan the files and directories given and print one JSON line per image")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes for --scan (default: CPU count)")
+    parser.add_argument('--ext', action='append', default=None,
+                        help="Extension to scan, repeatable (default: SUPPORTED_FILE_EXTENSIONS from config.py)")
+    parser.add_argument('--output', default=None, help="File to write the --scan JSON lines to (default: stdout)")
+    parser.add_argument('--cache', default=None, help="SQLite file to cache DPI values in")
+    parser.add_argument('--cache-key', choices=['stat', 'hash'], default='stat',
+                        help="Reuse cached values while path, size and mtime match (stat) "
+                             "or while the file contents match (hash)")
+    parser.add_argument('--changed-only', action='store_true',
+                        help="With --scan and --cache, only print files that were not in the cache")
+    args = parser.parse_args()
 
-    dpi_values = get_image_dpi(image_file_path)
+    if args.check:
+        mismatches = check_header_parser([path for path in args.images if path != "image.png"])
+        for image_path, header_dpi, pillow_dpi in mismatches:
+            print(f"{image_path}: header parser {header_dpi}, Pillow {pillow_dpi}")
+        print(f"{len(mismatches)} mismatches", file=sys.stderr)
+        sys.exit(1 if mismatches else 0)
 
-    if dpi_values:
-        print(f"Image: {image_file_path}")
-        print(f"Horizontal DPI: {dpi_values[0]}")
-        print(f"Vertical DPI: {dpi_values[1]}")
+    cache = DPICache(args.cache, args.cache_key) if args.cache else None
+    if args.scan:
+        records = scan_dpi(args.images, args.ext, args.workers, cache=cache, changed_only=args.changed_only)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                count = write_scan(records, f)
+            print(f"Scanned {count} images into {args.output}", file=sys.stderr)
+        else:
+            write_scan(records, sys.stdout)
+    elif args.bench:
+        for step, microseconds in benchmark(args.images, args.number):
+            print(f"{step:60} {microseconds:10.2f} us")
     else:
-        print(f"Could not determine DPI for image: {image_file_path}")
-        print("The image may not have DPI metadata, or it's stored in an unrecognized format.")
\ No newline at end of file
+        for image_file_path in args.images:
+            dpi_values = get_image_dpi(image_file_path, cache)
+
+            if dpi_values:
+                print(f"Image: {image_file_path}")
+                print(f"Horizontal DPI: {dpi_values[0]}")
+                print(f"Vertical DPI: {dpi_values[1]}")
+            else:
+                print(f"Could not determine DPI for image: {image_file_path}")
+                print("The image may not have DPI metadata, or it's stored in an unrecognized format.")
+
+    if cache is not None:
+        cache.close()
\ No newline at end of file